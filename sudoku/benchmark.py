@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+"""Time the solvers over the puzzle sets, in-process.
+
+    ./benchmark.py run --save baseline.json
+    ./benchmark.py run --baseline baseline.json
+    ./benchmark.py run --corpus puzzles.bin -n 1000
+
+Engines solve one puzzle per call, except the WHOLE_SET_ENGINES, which are
+timed solving a whole set at once. Their per-puzzle times are the set's
+time divided by its size, so the set total is comparable with the others
+but the per-puzzle median and p95 are just that average.
+"""
+
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+from functools import partial
+from itertools import islice
+
+import click
+
+from sudokuboard import SudokuBoardSolver, UnsolvableError
+from sudoku2.sudoku_state import SudokuBoard, SudokuState
+from sudoku2.sudoku_solver import (
+    SudokuSolver, WinnerTechnique, InvalidStateError)
+from sudoku2.dancing_links import SudokuExactCover
+from sudoku2.batch_solver import BatchSolver
+from sudoku2.sudoku_corpus import PuzzleCorpus
+
+PUZZLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'puzzles')
+SETS = [
+    ('easy', 'easy.txt'),
+    ('hard', 'hard.txt'),
+    ('top95', 'top95.txt'),
+    ('generated', 'generated.sudoku.txt'),
+]
+
+
+def legacy(puzzle):
+    board = SudokuBoardSolver()
+    try:
+        board.load_game(puzzle)
+        for msg in board.solve_iter():
+            pass
+    except (UnsolvableError, RuntimeError, ValueError):
+        # load_game raises RuntimeError or ValueError on malformed lines
+        return False
+    return board.is_solved()
+
+
+def sudoku2(puzzle):
+    try:
+        state = SudokuSolver(SudokuState.from_string(puzzle),
+                             enable_guessing=True).solve()
+    except InvalidStateError:
+        return False
+    return bool(WinnerTechnique.apply(state))
+
+
+def exact_cover(puzzle):
+    return SudokuExactCover(SudokuState.from_string(puzzle)).first_state() \
+        is not None
+
+
+_batch_solvers = {}
+
+
+def batch(puzzles):
+    """Solve a whole set with one BatchSolver call per x/m flag combination;
+    return whether each puzzle was solved"""
+    by_flags = OrderedDict()
+    for i, puzzle in enumerate(puzzles):
+        flags = puzzle[:len(puzzle) - len(puzzle.lstrip('xm'))]
+        by_flags.setdefault(flags, []).append(i)
+    solved = [False] * len(puzzles)
+    for flags, indexes in by_flags.iteritems():
+        if flags not in _batch_solvers:
+            _batch_solvers[flags] = BatchSolver(
+                SudokuBoard('x' in flags, 'm' in flags, n=3))
+        grids, status = _batch_solvers[flags].solve(
+            [puzzles[i] for i in indexes])
+        for i, s in zip(indexes, status):
+            solved[i] = s > 0
+    return solved
+
+
+ENGINES = [
+    ('legacy', legacy),
+    ('sudoku2', sudoku2),
+    ('exact-cover', exact_cover),
+    ('batch', batch),
+]
+# engines that take a list of puzzles and return a list of results
+WHOLE_SET_ENGINES = ('batch',)
+
+
+def load_set(name, limit=None):
+    with open(os.path.join(PUZZLES, dict(SETS)[name])) as f:
+        puzzles = [line.strip() for line in f
+                   if len(line.strip().lstrip('xm')) == 81]
+    return puzzles[:limit]
+
+
+def load_corpus(path, limit=None):
+    """Yield the puzzles of a packed corpus (see sudoku_corpus.pack)"""
+    corpus = PuzzleCorpus(path)
+    try:
+        for puzzle in islice(corpus, limit):
+            yield puzzle
+    finally:
+        corpus.close()
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a non-empty list
+
+    >>> percentile([3, 1, 2, 4], 50), percentile(range(1, 101), 95)
+    (2, 95)
+    """
+    values = sorted(values)
+    rank = max(0, int(-(-len(values) * p // 100)) - 1)
+    return values[rank]
+
+
+def time_puzzle(engine, puzzle, warmup=1, repeat=3):
+    """Return ([seconds per repetition], whether it was solved)"""
+    for _ in range(warmup):
+        engine(puzzle)
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        solved = engine(puzzle)
+        times.append(time.time() - start)
+    return times, solved
+
+
+def time_set(engine, puzzles, warmup=1, repeat=3):
+    """Return ([seconds per puzzle, per repetition], [whether each was
+    solved]) for a WHOLE_SET_ENGINES engine"""
+    for _ in range(warmup):
+        engine(puzzles)
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        solved = engine(puzzles)
+        times.append((time.time() - start) / len(puzzles))
+    return times, solved
+
+
+def run_benchmark(engines, sets, warmup=1, repeat=3, limit=None,
+                  log=None, log_puzzles=None):
+    """Time every engine on every set
+
+    sets are (name, load) pairs, where load(limit) gives the set's puzzles.
+    Returns {engine: {set: summary}}. per_puzzle in a summary maps each
+    puzzle to the [median, p95] of its repetitions; the summary's own
+    median, p95 and total are over those per-puzzle medians. For the
+    WHOLE_SET_ENGINES every puzzle gets the set's time over its size.
+    """
+    results = OrderedDict()
+    for engine_name, engine in engines:
+        results[engine_name] = OrderedDict()
+        for set_name, load in sets:
+            per_puzzle = OrderedDict()
+            solved = 0
+            for puzzle, times, ok in _timings(
+                    engine_name, engine, load(limit), warmup, repeat):
+                per_puzzle[puzzle] = [
+                    percentile(times, 50), percentile(times, 95)]
+                solved += bool(ok)
+                if log_puzzles:
+                    log_puzzles('{:<12} {} {:>10.5f} {:>10.5f}{}'.format(
+                        engine_name, puzzle, per_puzzle[puzzle][0],
+                        per_puzzle[puzzle][1], '' if ok else ' unsolved'))
+            summary = results[engine_name][set_name] = summarize(per_puzzle)
+            summary['solved'] = solved
+            if log:
+                log(format_row(engine_name, set_name, summary))
+    return results
+
+
+def _timings(engine_name, engine, puzzles, warmup, repeat):
+    """Yield (puzzle, [seconds per repetition], whether it was solved)"""
+    if engine_name in WHOLE_SET_ENGINES:
+        puzzles = list(puzzles)
+        if puzzles:
+            times, solved = time_set(engine, puzzles, warmup, repeat)
+            for puzzle, ok in zip(puzzles, solved):
+                yield puzzle, times, ok
+        return
+    for puzzle in puzzles:
+        times, ok = time_puzzle(engine, puzzle, warmup, repeat)
+        yield puzzle, times, ok
+
+
+def summarize(per_puzzle):
+    medians = [median for median, p95 in per_puzzle.values()]
+    return OrderedDict([
+        ('puzzles', len(medians)),
+        ('median', percentile(medians, 50) if medians else 0),
+        ('p95', percentile(medians, 95) if medians else 0),
+        ('total', sum(medians)),
+        ('per_puzzle', per_puzzle),
+    ])
+
+
+def format_row(engine, set_name, summary):
+    return '{:<12} {:<10} {:>6} {:>6} {:>10.5f} {:>10.5f} {:>9.3f}'.format(
+        engine, set_name, summary['puzzles'], summary['solved'],
+        summary['median'], summary['p95'], summary['total'])
+
+
+HEADER = '{:<12} {:<10} {:>6} {:>6} {:>10} {:>10} {:>9}'.format(
+    'engine', 'set', 'n', 'solved', 'median', 'p95', 'total')
+
+
+def regressions(results, baseline, tolerance=0.2, floor=0.001):
+    """Compare results with a baseline, yielding messages for slowdowns
+
+    Sets are compared on the puzzles both runs timed, so a run with a
+    different --limit can still be checked. A set regresses if the median
+    or p95 of its per-puzzle medians grew by more than tolerance; times
+    under floor seconds are too noisy to judge.
+
+    >>> old = {'e': {'s': {'per_puzzle': {'a': [0.1, 0.1], 'b': [0.2, 0.2]}}}}
+    >>> new = {'e': {'s': {'per_puzzle': {'a': [0.1, 0.1], 'b': [0.3, 0.3],
+    ...                                   'c': [9.0, 9.0]}}}}
+    >>> list(regressions(new, old))
+    ['e s p95: 0.20000s -> 0.30000s (+50%)']
+    >>> list(regressions(old, new))
+    []
+    """
+    for engine, sets in results.iteritems():
+        for set_name, summary in sets.iteritems():
+            old = baseline.get(engine, {}).get(set_name)
+            if not old:
+                continue
+            new_times, old_times = summary['per_puzzle'], old['per_puzzle']
+            common = [p for p in new_times if p in old_times]
+            if not common:
+                continue
+            for key, p in (('median', 50), ('p95', 95)):
+                before = percentile([old_times[c][0] for c in common], p)
+                after = percentile([new_times[c][0] for c in common], p)
+                if after > floor and after > before * (1 + tolerance):
+                    yield '{} {} {}: {:.5f}s -> {:.5f}s ({:+.0%})'.format(
+                        engine, set_name, key, before, after,
+                        after / before - 1 if before else float('inf'))
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option('-e', '--engine', 'engines', multiple=True,
+              type=click.Choice([name for name, f in ENGINES]),
+              help='Engines to run (default: all)')
+@click.option('-s', '--set', 'sets', multiple=True,
+              type=click.Choice([name for name, path in SETS]),
+              help='Puzzle sets to run (default: all)')
+@click.option('-w', '--warmup', type=int, default=1)
+@click.option('-r', '--repeat', type=int, default=3)
+@click.option('-c', '--corpus', 'corpora', multiple=True,
+              type=click.Path(exists=True),
+              help='Also run the puzzles of this packed corpus '
+                   '(alone, unless --set is given)')
+@click.option('-n', '--limit', type=int, default=None,
+              help='Only the first LIMIT puzzles of each set')
+@click.option('--save', type=click.Path(), help='Write results as JSON')
+@click.option('--baseline', type=click.Path(exists=True),
+              help='Flag regressions against this saved run')
+@click.option('--tolerance', type=float, default=0.2,
+              help='Allowed slowdown against the baseline (0.2 = 20%)')
+@click.option('-v', '--verbose', is_flag=True,
+              help='Print the median and p95 of every puzzle')
+def run(engines, sets, corpora, warmup, repeat, limit, save, baseline,
+        tolerance, verbose):
+    engines = [(name, f) for name, f in ENGINES
+               if not engines or name in engines]
+    sets = [(name, partial(load_set, name)) for name, path in SETS
+            if name in sets or not (sets or corpora)]
+    sets += [(os.path.basename(path), partial(load_corpus, path))
+             for path in corpora]
+    print HEADER
+
+    def log(row):
+        print row
+
+    results = run_benchmark(engines, sets, warmup, repeat, limit, log,
+                            log if verbose else None)
+    for name, f in engines:
+        if name in WHOLE_SET_ENGINES:
+            print '({}: timed per set; median and p95 are the set ' \
+                'average)'.format(name)
+    if save:
+        with open(save, 'w') as f:
+            json.dump(results, f, indent=1)
+    if baseline:
+        with open(baseline) as f:
+            flagged = list(regressions(results, json.load(f), tolerance))
+        for msg in flagged:
+            print 'REGRESSION ' + msg
+        if flagged:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli()
@@ -7,6 +7,7 @@ import sys
 import time
 from sudokuboard import (SudokuBoardSolver, SudokuBoardGenerator, N, N_2, N_4,
     ROW_LETTERS, UnsolvableError)
+from sudoku2.sudoku_cache import SolveCache
 import threading
 
 COLOR_SELECTED = 10
@@ -420,13 +421,13 @@ class SudokuDisplay:
             return
         self.stdscr.nodelay(False)
         wait = None
-        last_state = self.board.current_state()
+        last_version = self.board.version
         last_msg_ineffective = False
-        step_msgs = self.board.solve_step_iter(last_state, verbose=True)
+        step_msgs = self.board.solve_step_iter(last_version, verbose=True)
         for msg in step_msgs:
-            state = self.board.current_state()
+            version = self.board.version
             msg = str(msg)
-            if state == last_state:
+            if version == last_version:
                 msg += '...ineffective'
                 self.log(msg, replace=last_msg_ineffective)
                 last_msg_ineffective = True
@@ -440,7 +441,7 @@ class SudokuDisplay:
                         wait = False
                 elif wait is None:
                     wait = True
-            last_state = state
+            last_version = version
 
             self.draw_board()
 
@@ -454,31 +455,18 @@ class SudokuDisplay:
     def _compute_solution(self):
         if self._computed_solution:
             return self._computed_solution
-        solver = SudokuBoardSolver()
-        solver.load_game(self.board.current_state(givens_only=True))
+        givens = self.board.current_state(givens_only=True)
         self.log("Computing solution...")
-        last_status_clock = time.clock()
-        # try:
-        #     for msg in solver.solve_iter():
-        #         if time.clock() - last_status_clock > 1:
-        #             last_status_clock = time.clock()
-        #             self.log(msg, replace=True)
-        #             self.draw_board()
-        # except UnsolvableError:
-        #     pass
-        if not solver.is_solved():
-            self.log("Bruteforcing...")
-            for msg in solver.bruteforce_iter():
-                if time.clock() - last_status_clock > 1:
-                    last_status_clock = time.clock()
-                    self.log(msg, replace=True)
-                    self.draw_board()
-        if not solver.is_solved():
+        cache = SolveCache()
+        try:
+            record = cache.solve(givens)
+        finally:
+            cache.close()
+        if not record.solution:
             self.log("Unsolvable puzzle!")
             return None
-        if not self._computed_solution:
-            self._computed_solution = solver.current_state(
-                include_possibles=False)
+        self._computed_solution = "{}|{}".format(
+            givens, record.solution.lstrip('xm'))
         self._log_check_solution()
         return self._computed_solution
 
@@ -1,4 +1,4 @@
-from collections import defaultdict
+from collections import defaultdict, deque
 import itertools
 
 N = 3
@@ -13,49 +13,197 @@ class UnsolvableError(Exception):
     pass
 
 
+# candidate values as bitmasks: value v is bit v - 1
+ALL_VALUES = (1 << N_2) - 1
+VALUE_BITS = [0] + [1 << (v - 1) for v in range(1, N_2 + 1)]
+MASK_VALUES = [tuple(v for v in range(1, N_2 + 1) if mask & VALUE_BITS[v])
+               for mask in range(ALL_VALUES + 1)]
+POPCOUNT = [len(values) for values in MASK_VALUES]
+
+
+# flags a given square in snapshot()
+GIVEN = 1 << N_2
+
+
+def values_to_mask(values):
+    mask = 0
+    for v in values:
+        mask |= VALUE_BITS[v]
+    return mask
+
+
+class ChangeCounter(object):
+    """Counts the changes made to the squares that share it
+
+    While changed is a list, each square that changes is appended to it.
+    """
+    __slots__ = ('count', 'changed')
+
+    def __init__(self):
+        self.count = 0
+        self.changed = None
+
+
+def propagate(squares):
+    """Infer outward from squares until nothing more changes
+
+    Two queues drive it, so there is no recursion. The first holds squares
+    whose candidates changed; taking one off, the other squares in its
+    enabled sets re-infer if it gained a value, and each of those sets is
+    marked dirty. Dirty sets run try_solve, but only once the first queue
+    is empty. Squares changed on the way join the first queue, unless
+    they're on it already, so each (set, square) pair is handled once per
+    change and each dirty set is solved once however many of its squares
+    changed.
+
+    Returns the number of (set, square) pairs handled.
+
+    >>> row = ExclusiveSet('row')
+    >>> squares = [Square(x, 0) for x in range(N_2)]
+    >>> for x, sq in enumerate(squares):
+    ...     row.add_square(sq)
+    ...     if x < N_2 - 1:
+    ...         sq.set_value(x + 1)
+    >>> propagate(squares[-1:]), squares[-1]
+    (1, A8: ?=9)
+    """
+    queue = deque(squares)
+    queued = set(queue)
+    dirty = deque()
+    # boards share one counter; loose squares may each have their own
+    counters = set(sq.changes for sq in queue)
+    counters.update(peer.changes for sq in queue for peer in sq.peers)
+    for counter in counters:
+        counter.changed = []
+    propagations = 0
+    try:
+        while queue or dirty:
+            if queue:
+                trigger = queue.popleft()
+                queued.discard(trigger)
+                trigger.infer_values()
+                for s in trigger.enabled_sets:
+                    propagations += 1
+                    if trigger.get_value():
+                        for sq in s.squares:
+                            if sq is not trigger:
+                                sq.infer_values()
+                    if not s.dirty:
+                        s.dirty = True
+                        dirty.append(s)
+            else:
+                trigger = None
+                s = dirty.popleft()
+                s.dirty = False
+                s.try_solve()
+            for counter in counters:
+                for sq in counter.changed:
+                    # the trigger's own inference was handled just now
+                    if sq not in queued and sq is not trigger:
+                        queued.add(sq)
+                        queue.append(sq)
+                del counter.changed[:]
+    finally:
+        for counter in counters:
+            counter.changed = None
+        for s in dirty:
+            s.dirty = False
+    return propagations
+
+
 class Square(object):
-    def __init__(self, x, y):
+    __slots__ = ('name', 'x', 'y', 'id', 'is_given', '_value', 'mask',
+                 '_sets', '_enabled_sets', '_peers', 'solved', 'changed',
+                 'changes', 'prevented_value', 'value_attempts')
+
+    def __init__(self, x, y, changes=None):
         super(Square, self).__init__()
+        self.changes = changes or ChangeCounter()
         self.name = "{}{}".format(ROW_LETTERS[y], x)
         self.x = x
         self.y = y
         self.id = y * N_2 + x
         self.is_given = False
         self._value = None
-        self._sets = set()
+        self.mask = ALL_VALUES
+        self._sets = []
+        self._enabled_sets = None
+        self._peers = None
         self.solved = False
-        self.visited = False
         self.changed = False
         self.prevent_value(None)
         self.clear()
 
     @property
     def enabled_sets(self):
-        return set([s for s in self._sets if s.enabled])
+        if self._enabled_sets is None:
+            self._enabled_sets = tuple(s for s in self._sets if s.enabled)
+        return self._enabled_sets
+
+    @property
+    def peers(self):
+        """The other squares in my enabled sets"""
+        if self._peers is None:
+            peers = set()
+            for s in self.enabled_sets:
+                peers.update(s.squares)
+            peers.discard(self)
+            self._peers = tuple(peers)
+        return self._peers
 
     def add_set(self, s):
-        self._sets.add(s)
+        if s not in self._sets:
+            self._sets.append(s)
+        self._enabled_sets = None
+        self._peers = None
+
+    @property
+    def possible_values(self):
+        """The candidates as a new set; assign to change them"""
+        return set(MASK_VALUES[self.mask])
+
+    @possible_values.setter
+    def possible_values(self, values):
+        self._set_value_and_mask(self._value, values_to_mask(values))
+
+    def _set_value_and_mask(self, value, mask):
+        """Change the value, keeping the sets' used values in step"""
+        old = self._value
+        if mask != self.mask or value != old:
+            changes = self.changes
+            changes.count += 1
+            if changes.changed is not None:
+                changes.changed.append(self)
+        self._value = value
+        self.mask = mask
+        if old != value:
+            for s in self._sets:
+                s._value_changed(old, value)
+
+    def snapshot(self):
+        """My candidates as a mask, with GIVEN set if I'm a given"""
+        return self.mask | GIVEN if self.is_given else self.mask
+
+    def restore(self, snapshot):
+        """Go back to what snapshot() returned"""
+        self.is_given = bool(snapshot & GIVEN)
+        mask = snapshot & ALL_VALUES
+        value = MASK_VALUES[mask][0] if POPCOUNT[mask] == 1 else None
+        self._set_value_and_mask(value, mask)
 
     def clear(self):
         if not self.is_given:
-            self.possible_values = set(range(1, 10))
-            self._value = None
+            self._set_value_and_mask(None, ALL_VALUES)
 
     def is_solved(self):
-        return len(self.possible_values) == 1
+        return POPCOUNT[self.mask] == 1
 
     def try_solve(self):
-        if self.visited:
-            return
-        self.visited = True
-        self.infer_values()
-        for s in self.enabled_sets:
-            s.try_solve()
-        self.infer_values()
-        self.visited = False
+        """propagate() from me; returns the number of propagations"""
+        return propagate([self])
 
     def is_unknown(self):
-        return not self._value and len(self.possible_values) == 9
+        return not self._value and self.mask == ALL_VALUES
 
     def get_value(self):
         return self._value
@@ -63,22 +211,20 @@ class Square(object):
     def set_value(self, value, given=None):
         if given is not None:
             self.is_given = given
-        self._value = value
-        self.possible_values = set([value])
+        self._set_value_and_mask(value, VALUE_BITS[value or 0])
 
     def prevent_value(self, value):
         self.prevented_value = value
         self.clear()
         self.reset_values_to_attempt()
-        if self.prevented_value in self.possible_values:
-            self.possible_values.remove(self.prevented_value)
+        self._set_value_and_mask(
+            self._value, self.mask & ~VALUE_BITS[self.prevented_value or 0])
 
     def reset_values_to_attempt(self):
         if self.is_given:
             self.value_attempts = []
             return
-        all_values = set(range(1, 10))
-        self.value_attempts = list(all_values)
+        self.value_attempts = range(1, N_2 + 1)
         # probable_values = self._inferred_possible_values()
         # improbable_values = list(all_values - probable_values)
         # ideal_values = probable_values & self.possible_values
@@ -101,54 +247,67 @@ class Square(object):
         if self.is_unknown():
             self.set_value(value)
             return
-        if value in self.possible_values:
-            self.possible_values.remove(value)
-            if not any(self.possible_values):
-                self.clear()
-        else:
-            self.possible_values.add(value)
-        self.set_possible_values(self.possible_values)
+        mask = self.mask ^ VALUE_BITS[value]
+        if not mask:
+            self.clear()
+            mask = self.mask
+        self.set_mask(mask)
 
     def set_possible_values(self, possible_values):
+        self.set_mask(values_to_mask(possible_values))
 
-        if self.prevented_value in possible_values:
-            possible_values.remove(self.prevented_value)
-        if not any(possible_values):
+    def set_mask(self, mask):
+        mask &= ~VALUE_BITS[self.prevented_value or 0]
+        if not mask:
             raise UnsolvableError("No legal value for {}".format(self))
-        self.possible_values = possible_values
-        if len(self.possible_values) == 1:
-            self._value = tuple(self.possible_values)[0]
+        if POPCOUNT[mask] == 1:
+            self._set_value_and_mask(MASK_VALUES[mask][0], mask)
         else:
-            self._value = None
+            self._set_value_and_mask(None, mask)
 
     def eliminate_values(self, impossible_values):
-        self.set_possible_values(self.possible_values - impossible_values)
+        self.set_mask(self.mask & ~values_to_mask(impossible_values))
+
+    def has_conflict(self):
+        """any(self.conflict_squares()), without building the set"""
+        if self._value:
+            value = self._value
+            return any(s.counts[value] > 1 for s in self.enabled_sets)
+        if self.is_unknown():
+            return False
+        return any(s.used & self.mask for s in self.enabled_sets)
 
     def conflict_squares(self):
         sqs = set()
-        if self.is_unknown():
+        if not self.has_conflict():
             return sqs
-        for s in self.enabled_sets:
-            for square in s.squares:
-                if not square.is_unknown() and square != self:
-                    sv = square.get_value()
-                    if sv and sv in self.possible_values:
-                        sqs.add(square)
+        for square in self.peers:
+            sv = square._value
+            if sv and VALUE_BITS[sv] & self.mask:
+                sqs.add(square)
         return sqs
 
     def infer_values(self):
         if self.get_value():
             return
-        pv = self.possible_values & self._inferred_possible_values()
-        self.set_possible_values(pv)
+        self.set_mask(self.mask & self._inferred_possible_values())
+
+    def free_mask(self):
+        """Mask of the values I could take without a conflict"""
+        return (self._inferred_possible_values() &
+                ~VALUE_BITS[self.prevented_value or 0])
 
     def _inferred_possible_values(self):
-        possible_values = set(range(1, 10))
+        """Mask of the values no other square in my sets has"""
+        used = 0
         for s in self.enabled_sets:
-            for square in s.squares:
-                if square != self and square.get_value() in possible_values:
-                    possible_values.remove(square.get_value())
-        return possible_values
+            used |= s.used
+        if self._value:
+            # my own value only counts if another square has it too
+            bit = VALUE_BITS[self._value]
+            if not any(s.counts[self._value] > 1 for s in self.enabled_sets):
+                used &= ~bit
+        return ALL_VALUES & ~used
 
     def __repr__(self):
         out = self.name + ": "
@@ -159,7 +318,7 @@ class Square(object):
                 out += '?='
             out += str(self.get_value())
         else:
-            out += ' ??' + ''.join(sorted(map(str, self.possible_values)))
+            out += ' ??' + ''.join(map(str, MASK_VALUES[self.mask]))
         if self.prevented_value:
             out += '; !=' + str(self.prevented_value)
         # out += '; ~=' + ''.join(sorted(map(str, self.value_attempts)))
@@ -168,6 +327,9 @@ class Square(object):
 
 class ExclusiveSet(object):
     """A collection of exactly 9 squares"""
+    __slots__ = ('name', 'squares', 'solved', 'visited', 'changed', 'enabled',
+                 'dirty', 'used', 'counts')
+
     def __init__(self, name, enabled=True):
         super(ExclusiveSet, self).__init__()
         self.name = name
@@ -176,23 +338,37 @@ class ExclusiveSet(object):
         self.visited = False
         self.changed = False
         self.enabled = enabled
+        # waiting on a try_solve from propagate()
+        self.dirty = False
+        # mask of the values my squares have, and how many have each
+        self.used = 0
+        self.counts = [0] * (N_2 + 1)
 
     def set_enabled(self, enabled):
         self.enabled = enabled
+        for sq in self.squares:
+            sq._enabled_sets = None
+            sq._peers = None
+
+    def _value_changed(self, old, new):
+        counts = self.counts
+        if old:
+            counts[old] -= 1
+            if not counts[old]:
+                self.used &= ~VALUE_BITS[old]
+        if new:
+            counts[new] += 1
+            self.used |= VALUE_BITS[new]
 
     def known_values(self):
         if not self.enabled:
             return set()
-        vals = map(lambda s: s.get_value(), self.squares)
-        return set([v for v in vals if v is not None])
+        return set(MASK_VALUES[self.used])
 
     def is_solved(self):
         if self.solved or not self.enabled:
             return True
-        known_values = self.known_values()
-        if len(known_values) == len(self.squares) and None not in known_values:
-            return True
-        return False
+        return POPCOUNT[self.used] == len(self.squares)
 
     def try_solve(self):
         for msg in self.try_solve_iter():
@@ -201,15 +377,15 @@ class ExclusiveSet(object):
     def try_solve_iter(self, verbose=False):
         if not self.enabled or self.is_solved():
             return
-        known_values = self.known_values()
+        known = self.used
         # value -> set(squares possibly that value)
         possibles = {i: set() for i in range(1, 10)}
         solved_pairs = set()
         for sq in self.squares:
-            for v in sq.possible_values:
+            for v in MASK_VALUES[sq.mask]:
                 possibles[v].add(sq)
             # naked pairs
-            if len(sq.possible_values) == 2 and sq not in solved_pairs:
+            if POPCOUNT[sq.mask] == 2 and sq not in solved_pairs:
                 for msg in self._solve_naked_pairs(sq, solved_pairs,
                                                    verbose=verbose):
                     if verbose:
@@ -219,7 +395,7 @@ class ExclusiveSet(object):
         possibles_grouped = defaultdict(set)
         yield possibles
         for v, sqs in possibles.iteritems():
-            if v in known_values:
+            if known & VALUE_BITS[v]:
                 continue
             # If there's only one square with a given possible_value, solved!
             if len(sqs) == 1:
@@ -233,17 +409,22 @@ class ExclusiveSet(object):
                 for msg in self._eliminate_via_projection(v, sqs,
                                                           verbose=verbose):
                     yield msg
-        for msg in self._solve_groups(possibles_grouped):
+        for msg in self._solve_groups(possibles_grouped, verbose=verbose):
             yield msg
 
 
-    def _solve_groups(self, possibles_grouped):
-        yield dict(possibles_grouped)
+    def _solve_groups(self, possibles_grouped, verbose=False):
+        if verbose:
+            yield dict(possibles_grouped)
         for sqs, pvs in possibles_grouped.iteritems():
             if len(sqs) == len(pvs):
                 for sq in sqs:
-                    sq.set_possible_values(sq.possible_values & pvs)
-                yield "Reduced all but {} from {} within {}".format(pvs, sqs, self)
+                    sq.set_mask(sq.mask & values_to_mask(pvs))
+                if verbose:
+                    yield "Reduced all but {} from {} within {}".format(
+                        pvs, sqs, self)
+            if not verbose:
+                continue
             for sqs2, pvs2 in possibles_grouped.iteritems():
                 if sqs == sqs2:
                     continue
@@ -266,13 +447,14 @@ class ExclusiveSet(object):
 
     def _solve_naked_pairs(self, sq, solved_pairs, verbose=False):
         for sq2 in self.squares - solved_pairs:
-            if sq == sq2 or sq.possible_values != sq2.possible_values:
+            if sq is sq2 or sq.mask != sq2.mask:
                 continue
-            for sq_set in (sq.enabled_sets & sq2.enabled_sets):
+            for sq_set in sq.enabled_sets:
+                if sq_set not in sq2.enabled_sets:
+                    continue
                 for sq3 in sq_set.squares:
-                    if sq3 != sq and sq3 != sq2:
-                        sq3.set_possible_values(
-                            sq3.possible_values - sq.possible_values)
+                    if sq3 is not sq and sq3 is not sq2:
+                        sq3.set_mask(sq3.mask & ~sq.mask)
             solved_pairs.add(sq)
             solved_pairs.add(sq2)
             if verbose:
@@ -287,7 +469,7 @@ class ExclusiveSet(object):
             raise RuntimeError("No squares in {} with value {}!".format(
                 self, value))
         all_sq_sets = [sq.enabled_sets for sq in squares_with_value]
-        overlapping_sets = all_sq_sets[0].intersection(*all_sq_sets)
+        overlapping_sets = set(all_sq_sets[0]).intersection(*all_sq_sets)
 
         if self not in overlapping_sets:
             raise RuntimeError("self {} should be in {}".format(self,
@@ -302,16 +484,21 @@ class ExclusiveSet(object):
             return
         toggled_squares = 0
         for sq in overlapping_squares:
-            if value in sq.possible_values:
-                sq.toggle_mark(value)
+            if sq.mask & VALUE_BITS[value]:
+                # not toggle_mark: that would fill in a blank square
+                sq.set_mask(sq.mask & ~VALUE_BITS[value])
                 toggled_squares += 1
         if verbose and toggled_squares > 0:
             yield "project {} in {} to {} other sets ({} squares)".format(
                 value, self, len(overlapping_sets), toggled_squares)
 
     def add_square(self, square):
+        if square not in self.squares:
+            self._value_changed(None, square.get_value())
         self.squares.add(square)
         square.add_set(self)
+        for sq in self.squares:
+            sq._peers = None
 
     def __repr__(self):
         return "{}: {}".format(self.name, self.known_values())
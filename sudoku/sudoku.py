@@ -3,14 +3,22 @@
 import curses
 import click
 
+import json
+import random
 import sys
 import time
 from sudokuboard import SudokuBoardSolver, SudokuBoardGenerator, N, N_2, N_4, UnsolvableError
 from display import SudokuDisplay
 import threading
-from sudoku2.sudoku_state import set_N
-set_N(N)
-from sudoku2.sudoku_solver import SudokuGenerator
+from sudoku2.sudoku_state import SudokuBoard as SudokuBoard2
+from sudoku2.sudoku_state import SudokuState, StatePrinter
+from sudoku2.sudoku_solver import (
+    SudokuGenerator, SudokuSolver, WinnerTechnique, InvalidStateError)
+from sudoku2.sudoku_trace import set_sink, PrintSink, JsonLinesSink, DEBUG
+from sudoku2.sudoku_canonical import unique_puzzles
+from sudoku2.sudoku_cache import SolveCache
+from sudoku2.sudoku_corpus import PuzzleCorpus, pack as pack_corpus
+from sudoku2.sudoku_pool import solve_stream
 
 
 
@@ -25,9 +33,13 @@ def cli():
 @click.option('-m', '--meta-regions', is_flag=True)
 @click.option('-v', '--verbose', is_flag=True)
 @click.option('-g', '--generate', is_flag=True)
-def play(puzzle, x_regions, meta_regions, verbose, generate):
+@click.option('-c', '--corpus', type=click.Path(exists=True),
+              help='Take PUZZLE as an index into this packed corpus')
+def play(puzzle, x_regions, meta_regions, verbose, generate, corpus):
     if generate:
         puzzle = _generate(x_regions, meta_regions, verbose)
+    elif corpus:
+        puzzle = corpus_puzzle(corpus, puzzle)
     s = SudokuDisplay(x_regions, meta_regions)
     if puzzle:
         s.board.load_game(str(puzzle))
@@ -56,12 +68,27 @@ def log(msg, replace=False):
 @click.option('-x', '--x-regions', is_flag=True)
 @click.option('-m', '--meta-regions', is_flag=True)
 @click.option('-v', '--verbose', is_flag=True)
-def generate(x_regions, meta_regions, verbose):
-    _generate(x_regions, meta_regions, verbose)
+@click.option('-t', '--trace', type=click.Path(),
+              help='Append trace events to this file as JSON lines')
+def generate(x_regions, meta_regions, verbose, trace):
+    _generate(x_regions, meta_regions, verbose, trace)
 
 
-def _generate(x_regions, meta_regions, verbose):
-    result = SudokuGenerator.generate_puzzle()
+def _generate(x_regions, meta_regions, verbose, trace=None):
+    if trace:
+        sink = JsonLinesSink(trace)
+    elif verbose:
+        sink = PrintSink(DEBUG)
+    else:
+        sink = None
+    old_sink = set_sink(sink)
+    try:
+        result = SudokuGenerator.generate_puzzle(
+            SudokuBoard2(x_regions, meta_regions, n=N))
+    finally:
+        set_sink(old_sink)
+        if trace:
+            sink.close()
     # board = SudokuBoardGenerator(x_regions, meta_regions)
     # last_status_clock = time.clock()
     # for msg in board.generate_iter(verbose=verbose):
@@ -81,13 +108,49 @@ def _generate(x_regions, meta_regions, verbose):
 @click.option('-x', '--x-regions', is_flag=True)
 @click.option('-m', '--meta-regions', is_flag=True)
 @click.option('-v', '--verbose', is_flag=True)
-def solve(puzzle, x_regions, meta_regions, verbose):
+@click.option('-p', '--profile', is_flag=True,
+              help='Solve with sudoku2 and print per-technique stats')
+@click.option('--no-cache', is_flag=True,
+              help='Solve with the step-by-step solver, skipping the cache')
+@click.option('-c', '--corpus', type=click.Path(exists=True),
+              help='Take PUZZLE as an index into this packed corpus')
+def solve(puzzle, x_regions, meta_regions, verbose, profile, no_cache,
+          corpus):
+    if corpus:
+        puzzle = corpus_puzzle(corpus, puzzle)
+    if profile:
+        profile_solve(puzzle, x_regions, meta_regions)
+        return
+    if not (verbose or no_cache):
+        cached_solve(puzzle, x_regions, meta_regions)
+        return
     board = SudokuBoardSolver(x_regions, meta_regions)
     if puzzle:
         board.load_game(str(puzzle))
     console_solve(board, verbose=verbose)
 
 
+@cli.command('solve-batch')
+@click.argument('source', type=click.Path(allow_dash=True), default='-')
+@click.option('-c', '--corpus', is_flag=True,
+              help='SOURCE is a packed corpus rather than text')
+@click.option('-j', '--processes', type=int, default=None,
+              help='Worker processes (default: one per CPU)')
+@click.option('--chunk-size', type=int, default=64,
+              help='Puzzles sent to a worker at a time')
+@click.option('--unordered', is_flag=True,
+              help='Write results as they finish, not in input order')
+def solve_batch(source, corpus, processes, chunk_size, unordered):
+    """Solve every puzzle in SOURCE (default stdin), as JSON lines"""
+    if corpus:
+        puzzles = PuzzleCorpus(source)
+    else:
+        puzzles = _puzzle_lines(click.open_file(source))
+    results = solve_stream(puzzles, processes, chunk_size, not unordered)
+    for result in results:
+        sys.stdout.write(json.dumps(result, sort_keys=True) + '\n')
+
+
 @cli.command()
 @click.argument('puzzle', type=str, required=False)
 @click.option('-x', '--x-regions', is_flag=True)
@@ -112,6 +175,100 @@ def bruteforce(puzzle, x_regions, meta_regions, verbose):
         print "Could not solve " + board.current_state()
 
 
+@cli.command()
+@click.argument('corpus', type=click.File('r'), default='-')
+def dedup(corpus):
+    """Print the puzzles in CORPUS that aren't symmetries of earlier ones"""
+    for puzzle in unique_puzzles(_puzzle_lines(corpus)):
+        print puzzle
+
+
+@cli.command()
+@click.argument('source', type=click.Path(exists=True))
+@click.argument('dest', type=click.Path())
+def pack(source, dest):
+    """Convert a text file of puzzles into a packed corpus"""
+    print "Packed {} puzzles into {}".format(pack_corpus(source, dest), dest)
+
+
+def corpus_puzzle(path, index=None):
+    """Puzzle number index of a packed corpus, or a random one"""
+    corpus = PuzzleCorpus(path)
+    try:
+        if index is None:
+            return corpus[random.randrange(len(corpus))]
+        try:
+            return corpus[int(index)]
+        except (ValueError, IndexError):
+            raise click.BadParameter(
+                "{} is not an index into a corpus of {} puzzles".format(
+                    index, len(corpus)), param_hint='PUZZLE')
+    finally:
+        corpus.close()
+
+
+def _puzzle_lines(lines):
+    """Yield the lines that hold a puzzle, reporting others on stderr"""
+    for line in lines:
+        line = str(line.strip())
+        if len(line.lstrip('xm')) == N_4:
+            yield line
+        elif line:
+            click.echo("Skipping {!r}".format(line), err=True)
+
+
+def load_board(puzzle, x_regions, meta_regions):
+    """A solver board loaded from any line load_game accepts"""
+    board = SudokuBoardSolver(x_regions, meta_regions)
+    if puzzle:
+        board.load_game(str(puzzle).strip())
+    if x_regions:
+        board.set_x_regions(True)
+    if meta_regions:
+        board.set_meta_regions(True)
+    return board
+
+
+def cached_solve(puzzle, x_regions, meta_regions):
+    board = load_board(puzzle, x_regions, meta_regions)
+    # the cache only takes bare lines, so let the board do the parsing
+    puzzle = board.current_state(givens_only=True)
+    cache = SolveCache()
+    try:
+        record = cache.solve(puzzle)
+    except ValueError:
+        console_solve(board, verbose=False)
+        return
+    finally:
+        cache.close()
+    if record.solution:
+        print "Solved! {}|{}".format(puzzle, record.solution.lstrip('xm'))
+        print "({} solution, rating {})".format(
+            'unique' if record.count == 1 else 'not a unique', record.rating)
+    else:
+        print "Could not solve " + puzzle
+
+
+def profile_solve(puzzle, x_regions, meta_regions):
+    try:
+        # sudoku2 only takes bare lines, so let the board do the parsing
+        puzzle = load_board(puzzle, x_regions, meta_regions).current_state(
+            givens_only=True)
+        state = SudokuState.from_string(puzzle)
+    except (RuntimeError, ValueError) as e:
+        raise click.BadParameter(str(e), param_hint='PUZZLE')
+    solver = SudokuSolver(state, enable_guessing=True, profile=True)
+    try:
+        state = solver.solve()
+    except InvalidStateError:
+        state = None
+    if state and WinnerTechnique.apply(state):
+        print "Solved! " + StatePrinter.get_playable_state(state)
+    else:
+        print "Could not solve " + puzzle
+    print solver.profile.report()
+
+
 def console_solve(board, verbose=True):
     # prev_state = None
     # while board.current_state() != prev_state:
@@ -0,0 +1,214 @@
+import numpy as np
+
+from sudoku_state import SudokuBoard
+
+
+class BatchSolver(object):
+    """Solve many puzzles at once with NumPy.
+
+    B puzzles are held as a (B, N_4) uint16 array of candidate bitmasks, the
+    same encoding SudokuState uses. Each propagation step runs over every
+    board together:
+
+        eliminate: a known value is removed from the rest of its units
+        hidden singles: a value with one possible square in a unit is set
+
+    The units come straight from the board (Row, Column and Sector
+    constraints, plus X and Meta regions if enabled) as a (units, N_2) index
+    array. Boards that stop changing without being solved fall back to a
+    depth-first search, which branches on the square with the fewest
+    candidates. Each stalled board has its own search, but they step
+    together, so every round is still one batched propagation.
+
+    solve() returns a (B, N_4) uint8 array of values (0 where unknown) and a
+    (B,) int8 status array holding one of:
+
+        SOLVED: solved by propagation alone
+        SEARCHED: solved, but needed search
+        STALLED: propagation stalled and search was disabled
+        INVALID: the puzzle has no solution
+
+    >>> from sudoku_state import SudokuBoard
+    >>> solver = BatchSolver(SudokuBoard(n=3))
+    >>> puzzles = [
+    ...     '............942.8.16.....29........89.6.....14..25......4......'
+    ...     '.2...8.9..5....7..',
+    ...     '4.....8.5.3..........7......2.....6.....8.4......1.......6.3.'
+    ...     '7.5..2.....1.4......',
+    ...     '11' + '.' * 79]
+    >>> grids, status = solver.solve(puzzles)
+    >>> ''.join(str(v) for v in grids[0])[:27]
+    '249186573735942186168375429'
+    >>> list(status)
+    [1, 2, -1]
+    >>> grids, status = BatchSolver(SudokuBoard(n=3), search=False).solve(
+    ...     puzzles[1:2])
+    >>> list(status), (grids[0] == 0).sum() > 0
+    ([0], True)
+    """
+    STALLED = 0
+    SOLVED = 1
+    SEARCHED = 2
+    INVALID = -1
+
+    def __init__(self, board=None, search=True, chunk_size=4096):
+        self.board = board or SudokuBoard()
+        self.geometry = g = self.board.geometry
+        self.search = search
+        self.chunk_size = chunk_size
+        self.nodes = 0
+
+        self.units = np.array(self.board.units, dtype=np.intp)
+        # cell_units is ragged with X or Meta regions; pad it with an extra
+        # unit index whose mask is always 0
+        width = max(len(us) for us in self.board.cell_units)
+        self.cell_units = np.array(
+            [us + (len(self.units),) * (width - len(us))
+             for us in self.board.cell_units], dtype=np.intp)
+
+        self.bits = np.array(g.value_to_bitmask[1:], dtype=np.uint16)
+        self.popcount = np.array(g.popcount, dtype=np.uint8)
+        self.known_value = np.array(
+            [v or 0 for v in g.known_value], dtype=np.uint8)
+        # value 0 (unknown) starts with every candidate
+        self.value_to_bitmask = np.array(
+            (g.full_bitmask,) + g.value_to_bitmask[1:], dtype=np.uint16)
+
+    def load(self, puzzles):
+        """Return the candidate array for puzzle strings or an array of values
+
+        Strings use '.' or '0' for unknown squares; a leading x/m flag is
+        ignored (the board decides the constraints).
+        """
+        if isinstance(puzzles, np.ndarray):
+            values = puzzles
+        else:
+            values = np.array([self.parse(p) for p in puzzles],
+                              dtype=np.uint8)
+        values = values.reshape(-1, self.geometry.N_4)
+        if (values > self.geometry.N_2).any():
+            raise ValueError("Values out of range for {!r}".format(
+                self.geometry))
+        return self.value_to_bitmask[values]
+
+    def parse(self, puzzle):
+        puzzle = puzzle.strip().lstrip('xm')
+        if len(puzzle) != self.geometry.N_4:
+            raise ValueError("Expected {} squares, got {!r}".format(
+                self.geometry.N_4, puzzle))
+        chars = np.frombuffer(puzzle.replace('.', '0'), dtype=np.uint8)
+        return chars - ord('0')
+
+    def solve(self, puzzles):
+        """Return (grids, status) arrays for puzzles; see the class doc"""
+        cand = self.load(puzzles)
+        status = np.empty(len(cand), dtype=np.int8)
+        for start in range(0, len(cand), self.chunk_size):
+            end = start + self.chunk_size
+            status[start:end] = self.propagate(cand[start:end])
+        if self.search:
+            stalled = np.nonzero(status == self.STALLED)[0]
+            status[stalled] = self.INVALID
+            for b, solution in self._search(cand, stalled).iteritems():
+                cand[b] = solution
+                status[b] = self.SEARCHED
+        return self.known_value[cand], status
+
+    def propagate(self, cand):
+        """Propagate a candidate array to fixpoint in place; return status
+
+        Only boards still changing are carried into the next step.
+        """
+        status = np.full(len(cand), self.STALLED, dtype=np.int8)
+        active = np.arange(len(cand))
+        while len(active):
+            before = cand[active]
+            after, bad = self._step(before)
+            cand[active] = after
+            changed = (after != before).any(axis=1)
+
+            status[active[bad]] = self.INVALID
+            settled = active[~bad & ~changed]
+            solved = (self.popcount[cand[settled]] == 1).all(axis=1)
+            status[settled[solved]] = self.SOLVED
+            active = active[~bad & changed]
+        return status
+
+    def _step(self, cand):
+        """One round of elimination and hidden singles over every board
+
+        Returns the new candidates and a bool array of boards found to be
+        contradictory.
+        """
+        popcount = self.popcount
+        zero_unit = np.zeros((len(cand), 1), dtype=np.uint16)
+
+        # eliminate known values from their units
+        single = popcount[cand] == 1
+        known = np.where(single, cand, 0)
+        unit_known = np.bitwise_or.reduce(known[:, self.units], axis=2)
+        bad = (popcount[unit_known] !=
+               single[:, self.units].sum(axis=2)).any(axis=1)
+        unit_known = np.concatenate([unit_known, zero_unit], axis=1)
+        eliminate = np.bitwise_or.reduce(
+            unit_known[:, self.cell_units], axis=2)
+        cand = np.where(single, cand, cand & ~eliminate)
+
+        # hidden singles: digits with exactly one home in a unit
+        counts = ((cand[:, self.units, None] & self.bits) != 0).sum(axis=2)
+        bad |= (counts == 0).any(axis=(1, 2))
+        hidden = ((counts == 1) * self.bits).sum(axis=2, dtype=np.uint16)
+        hidden = np.concatenate([hidden, zero_unit], axis=1)
+        hidden = np.bitwise_or.reduce(
+            hidden[:, self.cell_units], axis=2) & cand
+        bad |= (popcount[hidden] > 1).any(axis=1)
+        cand = np.where(hidden != 0, hidden, cand)
+
+        bad |= (cand == 0).any(axis=1)
+        return cand, bad
+
+    def _search(self, cand, boards):
+        """Depth-first search from stalled boards, stepped together
+
+        Each board keeps its own stack of nodes. Every round pops one node
+        per board, branches on its square with the fewest candidates, and
+        propagates all the children of all boards in one batch. Returns
+        {board: solution candidates}; boards left out have no solution.
+        """
+        popcount = self.popcount
+        stacks = dict((b, [cand[b]]) for b in boards)
+        found = {}
+        while stacks:
+            owners = list(stacks)
+            nodes = np.array([stacks[b].pop() for b in owners])
+            counts = popcount[nodes]
+            cells = np.where(counts > 1, counts, 255).argmin(axis=1)
+            masks = nodes[np.arange(len(nodes)), cells]
+            branches = popcount[masks]
+
+            children = np.repeat(nodes, branches, axis=0)
+            values = np.broadcast_to(self.bits, (len(nodes), len(self.bits)))
+            children[np.arange(len(children)), np.repeat(cells, branches)] = (
+                values[(masks[:, None] & self.bits) != 0])
+            self.nodes += len(children)
+
+            status = self.propagate(children)
+            end = len(children)
+            for b, n in reversed(zip(owners, branches)):
+                # push in reverse so the lowest value is tried first
+                for j in range(end - 1, end - n - 1, -1):
+                    if b in found:
+                        break
+                    if status[j] == self.SOLVED:
+                        found[b] = children[j]
+                    elif status[j] == self.STALLED:
+                        stacks[b].append(children[j])
+                end -= n
+                if b in found or not stacks[b]:
+                    del stacks[b]
+        return found
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
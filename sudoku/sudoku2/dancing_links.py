@@ -0,0 +1,215 @@
+class DancingLinks(object):
+    """Knuth's Algorithm X on a sparse 0/1 matrix, with dancing links.
+
+    Finds sets of rows that cover every column exactly once. The matrix is a
+    toroidal doubly linked list stored in flat lists: node 0 is the root,
+    nodes 1..n_columns are the column headers and the rest are the 1s of
+    the rows. Covering a column unlinks it and every row that hits it;
+    uncovering relinks them in reverse order.
+
+    >>> dlx = DancingLinks(4, [('a', [0, 1]), ('b', [2]), ('c', [1, 2]),
+    ...                        ('d', [3]), ('e', [0])])
+    >>> [sorted(s) for s in dlx.solutions()]
+    [['a', 'b', 'd'], ['c', 'd', 'e']]
+    >>> dlx.count(limit=1)
+    1
+    >>> dlx.nodes > 0
+    True
+    """
+
+    def __init__(self, n_columns, rows):
+        """rows: iterable of (row id, column indexes)"""
+        n = n_columns + 1
+        self.L = [i - 1 for i in range(n)]
+        self.R = [i + 1 for i in range(n)]
+        self.L[0], self.R[-1] = n - 1, 0
+        self.U = range(n)
+        self.D = range(n)
+        self.C = range(n)
+        self.size = [0] * n
+        self.row_ids = [None] * n
+        self.nodes = 0
+
+        L, R, U, D, C = self.L, self.R, self.U, self.D, self.C
+        for row_id, columns in rows:
+            first = None
+            for column in columns:
+                c = column + 1
+                node = len(C)
+                C.append(c)
+                self.row_ids.append(row_id)
+                U.append(U[c])
+                D.append(c)
+                D[U[c]] = node
+                U[c] = node
+                self.size[c] += 1
+                if first is None:
+                    first = node
+                    L.append(node)
+                    R.append(node)
+                else:
+                    L.append(L[first])
+                    R.append(first)
+                    R[L[first]] = node
+                    L[first] = node
+
+    def solutions(self, limit=None):
+        """Return a list of solutions (lists of row ids), at most limit"""
+        found = []
+
+        def visit(solution):
+            found.append(solution)
+            return len(found) == limit
+        self._search([], visit)
+        return found
+
+    def first_solution(self):
+        """Return one solution, or None if there are none"""
+        for solution in self.solutions(limit=1):
+            return solution
+        return None
+
+    def count(self, limit=None):
+        """Count solutions, stopping once limit have been found"""
+        found = [0]
+
+        def visit(solution):
+            found[0] += 1
+            return found[0] == limit
+        self._search([], visit)
+        return found[0]
+
+    def _search(self, partial, visit):
+        """Call visit(solution) for each solution until it returns True
+
+        Every cover is undone on the way out, so the matrix can be searched
+        again afterwards.
+        """
+        R, D, C, size = self.R, self.D, self.C, self.size
+        if R[0] == 0:
+            return visit([self.row_ids[node] for node in partial])
+
+        # branch on the column with the fewest rows left
+        c = best = R[0]
+        while c:
+            if size[c] < size[best]:
+                best = c
+                if not size[c]:
+                    break
+            c = R[c]
+        c = best
+        if not size[c]:
+            return False
+
+        self._cover(c)
+        stop = False
+        node = D[c]
+        while node != c and not stop:
+            self.nodes += 1
+            partial.append(node)
+            j = R[node]
+            while j != node:
+                self._cover(C[j])
+                j = R[j]
+            stop = self._search(partial, visit)
+            j = self.L[node]
+            while j != node:
+                self._uncover(C[j])
+                j = self.L[j]
+            partial.pop()
+            node = D[node]
+        self._uncover(c)
+        return stop
+
+    def _cover(self, c):
+        L, R, U, D, C, size = (
+            self.L, self.R, self.U, self.D, self.C, self.size)
+        R[L[c]] = R[c]
+        L[R[c]] = L[c]
+        i = D[c]
+        while i != c:
+            j = R[i]
+            while j != i:
+                D[U[j]] = D[j]
+                U[D[j]] = U[j]
+                size[C[j]] -= 1
+                j = R[j]
+            i = D[i]
+
+    def _uncover(self, c):
+        L, R, U, D, C, size = (
+            self.L, self.R, self.U, self.D, self.C, self.size)
+        i = U[c]
+        while i != c:
+            j = L[i]
+            while j != i:
+                size[C[j]] += 1
+                D[U[j]] = j
+                U[D[j]] = j
+                j = L[j]
+            i = U[i]
+        R[L[c]] = c
+        L[R[c]] = c
+
+
+class SudokuExactCover(DancingLinks):
+    """A sudoku state as an exact cover problem.
+
+    Columns are "square i has a value" for every square, and "unit u has
+    value v" for every unit of the board's active constraints, so X and Meta
+    regions are covered too. Rows are the (square, value) pairs still
+    possible in the state, so known values and eliminations carry over.
+
+    >>> from sudoku_state import SudokuBoard, SudokuState
+    >>> state = SudokuState(board=SudokuBoard(x_regions=True, n=2))
+    >>> state.squares[0].set_value(1)
+    >>> cover = SudokuExactCover(state)
+    >>> cover.count(), cover.count(limit=2)
+    (12, 2)
+    >>> solved = cover.first_state()
+    >>> ''.join(str(sq.known_value) for sq in solved.squares)
+    '1234341243212143'
+    >>> solved.parent is state, cover.count()
+    (True, 12)
+    >>> import random
+    >>> solved = SudokuExactCover(state, random.Random(4)).first_state()
+    >>> ''.join(str(sq.known_value) for sq in solved.squares)
+    '1432321423414123'
+    >>> state.squares[5].set_value(1)
+    >>> print SudokuExactCover(state).first_state()
+    None
+    """
+
+    def __init__(self, state, rng=None):
+        """rng: if given, a random.Random used to shuffle the rows, so the
+        first solution found is a random one"""
+        self.state = state
+        g = state.geometry
+        cell_units = state.board.cell_units
+        n_squares = g.N_4
+
+        rows = [((i, v), [i] + [n_squares + u * g.N_2 + v - 1
+                                for u in cell_units[i]])
+                for i, bm in enumerate(state.masks)
+                for v in g.mask_to_values[bm]]
+        if rng:
+            rng.shuffle(rows)
+        super(SudokuExactCover, self).__init__(
+            n_squares + len(state.units) * g.N_2, rows)
+
+    def states(self, limit=None):
+        """Return solved copies of the state, at most limit of them"""
+        value_to_bitmask = self.state.geometry.value_to_bitmask
+        states = []
+        for solution in self.solutions(limit):
+            solved = self.state.copy()
+            for i, v in solution:
+                solved.set_bitmask(i, value_to_bitmask[v])
+            states.append(solved)
+        return states
+
+    def first_state(self):
+        """Return a solved copy of the state, or None if it has no solution"""
+        for solved in self.states(limit=1):
+            return solved
+        return None
@@ -0,0 +1,67 @@
+"""Bitboards: sets of squares as ints, with bit i standing for square i.
+
+SudokuState.digits holds one per value, for the squares where that value
+is still possible, so most pattern checks in the bitwise techniques are a
+few ands and ors against the board's unit_masks, peer_masks and
+intersections.
+"""
+
+
+def squares(board):
+    """Yield the squares in a bitboard, lowest first
+
+    >>> list(squares(0b10110))
+    [1, 2, 4]
+    """
+    while board:
+        low = board & -board
+        yield low.bit_length() - 1
+        board ^= low
+
+
+def popcount(board):
+    """
+    >>> popcount(1 << 80 | 0b101)
+    3
+    """
+    return bin(board).count('1')
+
+
+def eliminate(state, value, board):
+    """Remove value from the squares in board; return whether any changed
+
+    >>> from sudoku_state import SudokuState
+    >>> state = SudokuState.from_string('1...' + '.' * 12)
+    >>> eliminate(state, 2, 0b110), eliminate(state, 2, 0b10)
+    (True, False)
+    >>> bin(state.digits[2]), state.squares[1]
+    ('0b1111111111111000', sq#1 134)
+    """
+    bm = state.geometry.value_to_bitmask[value]
+    masks = state.masks
+    changed = False
+    for i in squares(board):
+        if masks[i] & bm:
+            state.set_bitmask(i, masks[i] & ~bm)
+            changed = True
+    return changed
+
+
+def eliminated(before, after):
+    """(square, values it lost) for each square whose bitmask changed
+
+    A square that changed without losing anything shows up with no values.
+
+    >>> from sudoku_state import SudokuState
+    >>> before = SudokuState.from_string('1...' + '.' * 12)
+    >>> after = before.copy()
+    >>> eliminate(after, 2, 0b110)
+    True
+    >>> after.set_bitmask(0, 0b11)
+    >>> eliminated(before, after)
+    [(0, ()), (1, (2,)), (2, (2,))]
+    """
+    mask_to_values = before.geometry.mask_to_values
+    return [(i, mask_to_values[bm & ~new_bm])
+            for i, (bm, new_bm) in enumerate(zip(before.masks, after.masks))
+            if bm != new_bm]
@@ -0,0 +1,179 @@
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict, namedtuple
+
+from sudoku_state import SudokuState, StatePrinter
+from sudoku_solver import (
+    SudokuSolver, SolverProfile, WinnerTechnique, InvalidStateError,
+    count_solutions)
+from sudoku_canonical import canonicalize
+
+DEFAULT_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'puzzles', 'solve_cache.sqlite')
+
+
+class SolveRecord(namedtuple('SolveRecord', 'solution count rating stats')):
+    """What solving a puzzle found out
+
+    solution: a solved line, or None if there is no solution
+    count: the number of solutions, up to 2 (so 2 means "not unique")
+    rating: SolverProfile.rating() of the solve, None if unsolvable
+    stats: {technique: [calls, seconds, eliminated, solved]}
+    """
+    __slots__ = ()
+
+
+def solve_record(puzzle):
+    """Solve a puzzle line from scratch
+
+    >>> record = solve_record('1..4' + '..1.' + '.4..' + '3..2')
+    >>> record.solution, record.count, record.rating
+    ('1324421324313142', 1, 1)
+    >>> record.stats['PropagateConstraints'][2:]
+    [30, 10]
+    >>> solve_record('12..' + '3...' + '....' + '...4')[1:3]
+    (2, 50)
+    >>> solve_record('11' + '.' * 14)
+    SolveRecord(solution=None, count=0, rating=None, stats={})
+    """
+    state = SudokuState.from_string(puzzle)
+    count = count_solutions(state, limit=2)
+    if not count:
+        return SolveRecord(None, 0, None, {})
+    profile = SolverProfile()
+    try:
+        solved = SudokuSolver(state, enable_guessing=True,
+                              profile=profile).solve()
+    except InvalidStateError:
+        solved = None
+    if not solved or not WinnerTechnique.apply(solved):
+        return SolveRecord(None, count, None, {})
+    stats = dict(
+        (name, [s.calls, s.seconds, s.eliminated, s.solved])
+        for name, s in profile.stats.iteritems())
+    return SolveRecord(StatePrinter.get_playable_state(solved), count,
+                       profile.rating(), stats)
+
+
+class SolveCache(object):
+    """SolveRecords kept in SQLite, with an in-memory LRU in front.
+
+    Records are stored by canonical form (see sudoku_canonical), so a puzzle
+    that is a symmetry of one already solved is a hit too. The LRU is keyed
+    by the puzzle line as given, so repeats skip canonicalizing as well.
+
+    The file holds at most max_entries records; past that, the ones used
+    longest ago are evicted.
+
+    >>> cache = SolveCache(':memory:', max_entries=2, memory_entries=1)
+    >>> cache.solve('12..' + '3...' + '....' + '...4').solution
+    '1243341243212134'
+    >>> cache.solve('43..' + '2...' + '....' + '...1').solution
+    '4312214312343421'
+    >>> cache.hits, cache.misses
+    (1, 1)
+    >>> cache.solve('1' + '.' * 15).count
+    2
+    >>> cache.solve('11' + '.' * 14).count
+    0
+    >>> len(cache)
+    2
+    >>> print cache.get('12..' + '3...' + '....' + '...4')
+    None
+    """
+
+    def __init__(self, path=DEFAULT_PATH, max_entries=100000,
+                 memory_entries=1024, solve=solve_record):
+        """solve: a function from a puzzle line to a SolveRecord"""
+        self.path = path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._solve = solve
+        self._memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS solves ('
+            ' puzzle TEXT PRIMARY KEY, solution TEXT, count INTEGER,'
+            ' rating INTEGER, stats TEXT, used REAL)')
+        self.db.execute(
+            'CREATE INDEX IF NOT EXISTS solves_used ON solves (used)')
+        self._size = self.db.execute(
+            'SELECT COUNT(*) FROM solves').fetchone()[0]
+
+    def __len__(self):
+        return self._size
+
+    def get(self, puzzle):
+        """Return the cached SolveRecord for a puzzle line, or None"""
+        puzzle = str(puzzle).strip()
+        record = self._memory.pop(puzzle, None)
+        if record is None:
+            canonical, back = canonicalize(puzzle)
+            row = self.db.execute(
+                'SELECT solution, count, rating, stats FROM solves'
+                ' WHERE puzzle = ?', (canonical,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute('UPDATE solves SET used = ? WHERE puzzle = ?',
+                            (time.time(), canonical))
+            self.db.commit()
+            solution, count, rating, stats = row
+            record = SolveRecord(
+                solution and back.apply(str(solution)), count, rating,
+                json.loads(stats))
+        self._remember(puzzle, record)
+        return record
+
+    def put(self, puzzle, record):
+        puzzle = str(puzzle).strip()
+        canonical, back = canonicalize(puzzle)
+        forward = back.inverse()
+        solution = record.solution and forward.apply(record.solution)
+        added = self.db.execute(
+            'SELECT 1 FROM solves WHERE puzzle = ?',
+            (canonical,)).fetchone() is None
+        self.db.execute(
+            'INSERT OR REPLACE INTO solves VALUES (?, ?, ?, ?, ?, ?)',
+            (canonical, solution, record.count, record.rating,
+             json.dumps(record.stats), time.time()))
+        self._size += added
+        if self._size > self.max_entries:
+            self._evict(self._size - self.max_entries)
+        self.db.commit()
+        self._remember(puzzle, record)
+
+    def solve(self, puzzle):
+        """Return the SolveRecord for a puzzle line, solving it if need be"""
+        record = self.get(puzzle)
+        if record is not None:
+            self.hits += 1
+            return record
+        self.misses += 1
+        record = self._solve(str(puzzle).strip())
+        self.put(puzzle, record)
+        return record
+
+    def _remember(self, puzzle, record):
+        self._memory[puzzle] = record
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, n):
+        self.db.execute(
+            'DELETE FROM solves WHERE puzzle IN'
+            ' (SELECT puzzle FROM solves ORDER BY used, rowid LIMIT ?)',
+            (n,))
+        self._size -= n
+
+    def close(self):
+        self.db.close()
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
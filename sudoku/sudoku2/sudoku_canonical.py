@@ -0,0 +1,212 @@
+import string
+from collections import namedtuple
+from itertools import permutations
+from operator import itemgetter
+
+from sudoku_state import SudokuState, StatePrinter
+from sudoku_solver import SudokuSolver, WinnerTechnique, InvalidStateError
+
+DIGITS = '123456789'
+
+
+class SudokuTransform(namedtuple('SudokuTransform', 'cells digits')):
+    """A relabelling of a puzzle line's squares and values
+
+    Square i of the result is square cells[i] of the input, with value v
+    renamed to digits[v - 1]. Flags are passed through unchanged.
+
+    >>> t = SudokuTransform(cells=(3, 2, 1, 0) + tuple(range(4, 16)),
+    ...                     digits='2143')
+    >>> t.apply('x12..' + '.' * 12)
+    'x..12............'
+    >>> t.inverse().apply(t.apply('x3.4.' + '.' * 12))
+    'x3.4.............'
+    """
+    __slots__ = ()
+
+    def apply(self, puzzle):
+        values = puzzle.lstrip('xm')
+        flags = puzzle[:len(puzzle) - len(values)]
+        table = string.maketrans(DIGITS[:len(self.digits)], self.digits)
+        return flags + ''.join(
+            itemgetter(*self.cells)(values)).translate(table)
+
+    def inverse(self):
+        cells = [0] * len(self.cells)
+        for i, c in enumerate(self.cells):
+            cells[c] = i
+        digits = [None] * len(self.digits)
+        for v, d in enumerate(self.digits):
+            digits[DIGITS.index(d)] = DIGITS[v]
+        return SudokuTransform(tuple(cells), ''.join(digits))
+
+
+_spatial_transforms = {}
+
+
+def spatial_transforms(n, x_regions=False, meta_regions=False):
+    """Square permutations that map a board of this kind onto itself
+
+    Band and stack permutations, composed with the 8 rotations and
+    reflections of the square (transposition among them). X regions only
+    survive band and stack permutations that are the same and commute with
+    flipping the board, and Meta regions only survive the rotations and
+    reflections.
+
+    >>> len(spatial_transforms(3)), len(spatial_transforms(3, True))
+    (288, 16)
+    >>> len(spatial_transforms(3, False, True)), len(spatial_transforms(2))
+    (8, 32)
+    """
+    key = (n, x_regions, meta_regions)
+    if key in _spatial_transforms:
+        return _spatial_transforms[key]
+    N_2 = n * n
+    M = N_2 - 1
+    rotations = [
+        lambda r, c: (r, c), lambda r, c: (c, r),
+        lambda r, c: (r, M - c), lambda r, c: (M - r, c),
+        lambda r, c: (M - r, M - c), lambda r, c: (c, M - r),
+        lambda r, c: (M - c, r), lambda r, c: (M - c, M - r)]
+    bands = list(permutations(range(n)))
+    if meta_regions:
+        bands = [tuple(range(n))]
+    if x_regions or meta_regions:
+        pairs = [(p, p) for p in bands
+                 if all(p[n - 1 - i] == n - 1 - p[i] for i in range(n))]
+    else:
+        pairs = [(p, q) for p in bands for q in bands]
+
+    transforms = set()
+    for rotate in rotations:
+        for p, q in pairs:
+            rows = [p[r // n] * n + r % n for r in range(N_2)]
+            columns = [q[c // n] * n + c % n for c in range(N_2)]
+            cells = []
+            for r in range(N_2):
+                for c in range(N_2):
+                    sr, sc = rotate(rows[r], columns[c])
+                    cells.append(sr * N_2 + sc)
+            transforms.add(tuple(cells))
+    transforms = _spatial_transforms[key] = sorted(transforms)
+    return transforms
+
+
+def canonicalize(puzzle):
+    """Return (canonical puzzle, transform from it back to puzzle)
+
+    The canonical form is the smallest line, with '.' before any digit, over
+    every spatial transform of the puzzle's board kind, with values renamed
+    1, 2, ... in order of first appearance. Puzzles that are the same up to
+    those symmetries have the same canonical form, and the transform maps
+    the canonical form's solution back to one of puzzle's.
+
+    >>> puzzle = '12..' + '3...' + '....' + '...4'
+    >>> canonical, back = canonicalize(puzzle)
+    >>> canonical
+    '.......123..4...'
+    >>> back.apply(canonical) == puzzle
+    True
+    >>> rotated = ''.join(puzzle[c] for c in spatial_transforms(2)[7])
+    >>> canonicalize(rotated.translate(string.maketrans('1234', '4321')))[0]
+    '.......123..4...'
+    >>> canonicalize('m' + puzzle)[0]
+    'm...1....2...34..'
+    >>> canonicalize('12345')
+    Traceback (most recent call last):
+        ...
+    ValueError: Not a puzzle line: '12345'
+    """
+    puzzle = puzzle.strip()
+    values = puzzle.lstrip('xm')
+    flags = puzzle[:len(puzzle) - len(values)]
+    n = int(round(len(values) ** 0.25))
+    digits = DIGITS[:n * n]
+    values = values.replace('0', '.')
+    if n ** 4 != len(values) or values.translate(None, '.' + digits):
+        raise ValueError("Not a puzzle line: {!r}".format(puzzle))
+
+    best = best_cells = best_labels = None
+    for cells in spatial_transforms(n, 'x' in flags, 'm' in flags):
+        moved = ''.join(itemgetter(*cells)(values))
+        # name values by order of first appearance
+        labels = ''
+        for ch in moved:
+            if ch in digits and ch not in labels:
+                labels += ch
+        relabelled = moved.translate(
+            string.maketrans(labels, digits[:len(labels)]))
+        if best is None or relabelled < best:
+            best, best_cells, best_labels = relabelled, cells, labels
+    # values the puzzle never uses can be named anything; keep them in order
+    best_labels += ''.join(d for d in digits if d not in best_labels)
+    forward = SudokuTransform(
+        best_cells, ''.join(digits[best_labels.index(d)] for d in digits))
+    return flags + best, forward.inverse()
+
+
+def unique_puzzles(puzzles):
+    """Yield the puzzles whose canonical form hasn't been seen before
+
+    >>> puzzles = ['1' + '.' * 15, '.' * 15 + '2', '12' + '.' * 14]
+    >>> list(unique_puzzles(puzzles))
+    ['1...............', '12..............']
+    """
+    seen = set()
+    for puzzle in puzzles:
+        canonical = canonicalize(puzzle)[0]
+        if canonical not in seen:
+            seen.add(canonical)
+            yield puzzle
+
+
+def solve_state(state):
+    """Solve a state with SudokuSolver; return None if it can't be solved"""
+    try:
+        state = SudokuSolver(state, enable_guessing=True).solve()
+    except InvalidStateError:
+        return None
+    return state if WinnerTechnique.apply(state) else None
+
+
+class CanonicalSolveCache(object):
+    """Solutions to puzzles, kept by canonical form.
+
+    Equivalent puzzles are solved once; each gets the cached solution
+    mapped back through its own transform.
+
+    >>> cache = CanonicalSolveCache()
+    >>> cache.solve('12..' + '3...' + '....' + '...4')
+    '1243341243212134'
+    >>> cache.solve('43..' + '2...' + '....' + '...1')
+    '4312214312343421'
+    >>> cache.hits, cache.misses
+    (1, 1)
+    >>> print cache.solve('11' + '.' * 14)
+    None
+    """
+
+    def __init__(self, solve=solve_state):
+        """solve: a function from a SudokuState to a solved one or None"""
+        self._solve = solve
+        self.solutions = {}
+        self.hits = 0
+        self.misses = 0
+
+    def solve(self, puzzle):
+        """Return puzzle's solution line, or None if it has none"""
+        canonical, back = canonicalize(puzzle)
+        if canonical in self.solutions:
+            self.hits += 1
+            solution = self.solutions[canonical]
+        else:
+            self.misses += 1
+            solved = self._solve(SudokuState.from_string(canonical))
+            solution = solved and StatePrinter.get_playable_state(solved)
+            self.solutions[canonical] = solution
+        return solution and back.apply(solution)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,147 @@
+import mmap
+import string
+import struct
+
+MAGIC = 'SDKC'
+VERSION = 1
+# magic, version, N, flags, count
+HEADER = struct.Struct('<4sBBBxQ')
+
+X_REGIONS = 1
+META_REGIONS = 2
+# records have a flags byte of their own
+MIXED = 4
+
+_DOT_TO_ZERO = string.maketrans('.', '0')
+_ZERO_TO_DOT = string.maketrans('0', '.')
+
+
+def line_flags(line):
+    """
+    >>> line_flags('xm12.'), line_flags('12.'), line_flags('m.')
+    (3, 0, 2)
+    """
+    flags = line[:len(line) - len(line.lstrip('xm'))]
+    return ((X_REGIONS if 'x' in flags else 0) |
+            (META_REGIONS if 'm' in flags else 0))
+
+
+def flags_prefix(flags):
+    return ('x' if flags & X_REGIONS else '') + (
+        'm' if flags & META_REGIONS else '')
+
+
+def pack(text_path, corpus_path):
+    """Convert a text file of puzzle lines into a packed corpus
+
+    Each square takes one nibble, first square in the high nibble, so a
+    9x9 record is 41 bytes. Lines that aren't puzzles of the same size as
+    the first are skipped. If the lines disagree about x/m flags, each
+    record gets a flags byte in front; otherwise the header holds them.
+
+    Returns the number of puzzles written.
+    """
+    n_4 = None
+    flag_set = set()
+    with open(text_path) as lines:
+        for line in _puzzle_lines(lines):
+            values = line.lstrip('xm')
+            if n_4 is None:
+                n_4 = len(values)
+            if len(values) == n_4:
+                flag_set.add(line_flags(line))
+    if n_4 is None:
+        raise ValueError("No puzzles in {}".format(text_path))
+    n = int(round(n_4 ** 0.25))
+    if n ** 4 != n_4 or n > 3:
+        raise ValueError("Can't pack puzzles of {} squares".format(n_4))
+    flags = flag_set.pop() if len(flag_set) == 1 else MIXED
+
+    count = 0
+    with open(text_path) as lines, open(corpus_path, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, VERSION, n, flags, 0))
+        for line in _puzzle_lines(lines):
+            values = line.lstrip('xm')
+            if len(values) != n_4:
+                continue
+            if flags & MIXED:
+                out.write(chr(line_flags(line)))
+            values = values.translate(_DOT_TO_ZERO)
+            out.write((values + '0' * (n_4 % 2)).decode('hex'))
+            count += 1
+        out.seek(0)
+        out.write(HEADER.pack(MAGIC, VERSION, n, flags, count))
+    return count
+
+
+def _puzzle_lines(lines):
+    for line in lines:
+        line = line.strip()
+        values = line.lstrip('xm')
+        if values and not values.translate(None, '.0123456789'):
+            yield line
+
+
+class PuzzleCorpus(object):
+    """Read-only, memory-mapped access to a packed corpus (see pack)
+
+    corpus[i] is the i-th puzzle line, found by offset and unpacked on its
+    own, so opening and indexing a corpus costs the same whatever its size.
+
+    >>> import os, tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> text = os.path.join(directory, 'puzzles.txt')
+    >>> with open(text, 'w') as f:
+    ...     f.write('1.3.' + '.' * 12 + '\\n\\x1a\\n' + 'x' + '4' * 16 + '\\n')
+    >>> pack(text, os.path.join(directory, 'puzzles.bin'))
+    2
+    >>> corpus = PuzzleCorpus(os.path.join(directory, 'puzzles.bin'))
+    >>> len(corpus), corpus.n, corpus.record_size
+    (2, 2, 9)
+    >>> corpus[0], corpus[-1]
+    ('1.3.............', 'x4444444444444444')
+    >>> list(corpus) == [corpus[0], corpus[1]]
+    True
+    >>> corpus.close()
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.n, self.flags, self._count = HEADER.unpack(
+            self._map[:HEADER.size])
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a packed puzzle corpus".format(path))
+        self.n_4 = self.n ** 4
+        self._mixed = bool(self.flags & MIXED)
+        self._prefix = flags_prefix(self.flags)
+        self.record_size = (self.n_4 + 1) // 2 + self._mixed
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError("corpus index out of range")
+        start = HEADER.size + i * self.record_size
+        record = self._map[start:start + self.record_size]
+        prefix = self._prefix
+        if self._mixed:
+            prefix = flags_prefix(ord(record[0]))
+            record = record[1:]
+        return prefix + record.encode('hex')[:self.n_4].translate(_ZERO_TO_DOT)
+
+    def __iter__(self):
+        for i in xrange(self._count):
+            yield self[i]
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,108 @@
+import multiprocessing
+import time
+from collections import deque
+from itertools import islice
+
+from sudoku_state import SudokuState, StatePrinter
+from sudoku_solver import (
+    SudokuSolver, SolverProfile, WinnerTechnique, InvalidStateError)
+
+
+def solve_line(index, puzzle):
+    """Solve one puzzle line into a JSON-ready dict
+
+    >>> result = solve_line(3, '1..4' + '..1.' + '.4..' + '3..2')
+    >>> sorted(result)
+    ['index', 'nodes', 'puzzle', 'seconds', 'solution']
+    >>> result['solution'], result['nodes']
+    ('1324421324313142', 0)
+    >>> print solve_line(0, '11' + '.' * 14)['solution']
+    None
+    >>> solve_line(0, '123')['error']
+    "Expected 16, 81 or 256 squares, got '123'"
+    """
+    result = {'index': index, 'puzzle': puzzle}
+    start = time.time()
+    profile = SolverProfile()
+    try:
+        state = SudokuSolver(SudokuState.from_string(puzzle),
+                             enable_guessing=True, profile=profile).solve()
+    except InvalidStateError:
+        state = None
+    except ValueError as e:
+        result['error'] = str(e)
+        return result
+    result['seconds'] = round(time.time() - start, 6)
+    result['nodes'] = profile.count('GuessAndCheck', 'nodes')
+    result['solution'] = (
+        StatePrinter.get_playable_state(state)
+        if state and WinnerTechnique.apply(state) else None)
+    return result
+
+
+def solve_chunk(chunk):
+    """solve_line over a list of (index, puzzle)"""
+    return [solve_line(index, puzzle) for index, puzzle in chunk]
+
+
+def solve_stream(puzzles, processes=None, chunk_size=64, ordered=True):
+    """Solve puzzle lines on a process pool, yielding solve_line results
+
+    Puzzles are read and sent out a chunk at a time, with at most two chunks
+    per process in flight, so memory stays flat however long the input is.
+    With ordered=False results come out as soon as their chunk is done.
+
+    >>> puzzles = ['1..4' + '..1.' + '.4..' + '3..2', '11' + '.' * 14] * 3
+    >>> results = list(solve_stream(puzzles, processes=2, chunk_size=2))
+    >>> [r['index'] for r in results]
+    [0, 1, 2, 3, 4, 5]
+    >>> unordered = solve_stream(puzzles, 2, 2, ordered=False)
+    >>> sorted(r['index'] for r in unordered)
+    [0, 1, 2, 3, 4, 5]
+    """
+    processes = processes or multiprocessing.cpu_count()
+    window = 2 * processes
+    pool = multiprocessing.Pool(processes)
+    pending = deque()
+    chunks = _chunks(enumerate(puzzles), chunk_size)
+    try:
+        for chunk in chunks:
+            pending.append(pool.apply_async(solve_chunk, (chunk,)))
+            while len(pending) >= window:
+                for result in _next_done(pending, ordered):
+                    yield result
+        while pending:
+            for result in _next_done(pending, ordered):
+                yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def _next_done(pending, ordered, poll=0.01):
+    """Take a finished chunk off pending and return its results
+
+    Ordered, that is always the oldest; otherwise whichever is done first.
+    """
+    if ordered:
+        return pending.popleft().get()
+    while True:
+        for i, async_result in enumerate(pending):
+            if async_result.ready():
+                del pending[i]
+                return async_result.get()
+        pending[0].wait(poll)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,192 @@
+from collections import deque
+
+
+class ConstraintPropagator:
+    """Worklist-driven version of EliminateValues.
+
+    Rather than sweeping every unit until a whole pass changes nothing, keep a
+    queue of dirty units and re-examine only the units containing a square
+    that actually changed. Each visit applies the rules of EliminateValues:
+    naked singles, hidden singles and naked subsets.
+
+    Matching subsets only by identical bitmasks (as EliminateValues does) makes
+    the result depend on the order eliminations happen in: {12, 123, 23} is
+    as much a triple as {123, 123, 123}. So subsets here are any k squares
+    (k <= MAX_SUBSET) whose combined possible values number k, with identical
+    bitmasks still matched at any size. Every rule then only gets stronger as
+    candidates disappear, so the fixpoint is unique, and it is always at least
+    as far along as a run of EliminateValues.
+
+    propagate() stops and returns False as soon as a unit shows the state
+    is a contradiction: a value known twice, a square with no possible
+    values, a value with no possible square, or a square that is the only
+    home for two values.
+
+    Counters:
+        unit_visits: units actually examined
+        rounds: generations of the worklist; a full-sweep solver needs one
+            pass over every unit per round
+        full_sweep_visits: rounds * number of units
+        unit_visits_saved: full_sweep_visits - unit_visits
+
+    >>> from sudoku_state import set_N, SudokuBoard, SudokuState
+    >>> set_N(2)
+    >>> state = SudokuState(board=SudokuBoard(x_regions=True))
+    >>> for i, v in ((0, 1), (5, 2), (10, 3)):
+    ...     state.squares[i].set_value(v)
+    >>> propagator = ConstraintPropagator(state)
+    >>> propagator.propagate()
+    True
+    >>> state.squares[15]
+    sq#15 4
+    >>> propagator.unit_visits < propagator.full_sweep_visits
+    True
+    >>> state.squares[14].set_value(4)
+    >>> propagator.propagate([14]), propagator.contradiction
+    (False, True)
+    """
+    MAX_SUBSET = 4
+
+    def __init__(self, state):
+        self.state = state
+        self.units = state.board.units
+        self.cell_units = state.board.cell_units
+        self.unit_visits = 0
+        self.rounds = 0
+        self.contradiction = False
+
+    @property
+    def full_sweep_visits(self):
+        return self.rounds * len(self.units)
+
+    @property
+    def unit_visits_saved(self):
+        return self.full_sweep_visits - self.unit_visits
+
+    def propagate(self, dirty_cells=None):
+        """Run to fixpoint, starting from the units containing dirty_cells
+        (all units if None). Return False if a contradiction was found."""
+        self.contradiction = False
+        if dirty_cells is None:
+            queue = deque(range(len(self.units)))
+        else:
+            queue = deque(sorted(set(
+                u for i in dirty_cells for u in self.cell_units[i])))
+        queued = bytearray(len(self.units))
+        for u in queue:
+            queued[u] = 1
+
+        cell_units = self.cell_units
+        round_left = len(queue)
+        if queue:
+            self.rounds += 1
+        while queue:
+            if not round_left:
+                self.rounds += 1
+                round_left = len(queue)
+            round_left -= 1
+
+            u = queue.popleft()
+            queued[u] = 0
+            self.unit_visits += 1
+            changed = self._visit(self.units[u])
+            if self.contradiction:
+                return False
+            for i in changed:
+                for u2 in cell_units[i]:
+                    if not queued[u2]:
+                        queued[u2] = 1
+                        queue.append(u2)
+        return True
+
+    def _visit(self, unit):
+        """Apply the elimination rules to one unit; return changed squares
+
+        Sets self.contradiction and returns early if the unit can't be
+        completed.
+        """
+        state = self.state
+        masks = state.masks
+        known_value = state.geometry.known_value
+        popcount = state.geometry.popcount
+        changed = set()
+
+        # naked singles: a known value can't appear elsewhere in the unit
+        known = 0
+        for i in unit:
+            bm = masks[i]
+            if known_value[bm]:
+                if known & bm or not bm:
+                    self.contradiction = True
+                    return changed
+                known |= bm
+            elif not bm:
+                self.contradiction = True
+                return changed
+        if known:
+            for i in unit:
+                bm = masks[i]
+                if bm & known and not known_value[bm]:
+                    bm &= ~known
+                    state.set_bitmask(i, bm)
+                    changed.add(i)
+                    if not bm:
+                        self.contradiction = True
+                        return changed
+
+        # hidden singles: a value with only one possible square
+        once = twice = 0
+        for i in unit:
+            bm = masks[i]
+            twice |= once & bm
+            once |= bm
+        if once != state.geometry.full_bitmask:
+            self.contradiction = True
+            return changed
+        hidden = once & ~twice
+        if hidden:
+            for i in unit:
+                bm = masks[i]
+                if bm & hidden and not known_value[bm]:
+                    if not known_value[bm & hidden]:
+                        self.contradiction = True
+                        return changed
+                    state.set_bitmask(i, bm & hidden)
+                    changed.add(i)
+
+        # naked subsets: k squares sharing the same k possible values
+        sqs_by_bitmask = {}
+        for i in unit:
+            sqs_by_bitmask.setdefault(masks[i], []).append(i)
+        subsets = [(mask, sqs)
+                   for mask, sqs in sorted(sqs_by_bitmask.iteritems())
+                   if len(sqs) > self.MAX_SUBSET and
+                   len(sqs) == popcount[mask]]
+        candidates = [i for i in unit if 1 < popcount[masks[i]] <=
+                      self.MAX_SUBSET]
+        if len(candidates) > 1:
+            self._find_subsets(candidates, 0, 0, [], subsets)
+        for bm, sqs in subsets:
+            for i in unit:
+                if masks[i] & bm and i not in sqs:
+                    state.set_bitmask(i, masks[i] & ~bm)
+                    changed.add(i)
+                    if not masks[i]:
+                        self.contradiction = True
+                        return changed
+        return changed
+
+    def _find_subsets(self, candidates, start, union, members, found):
+        masks = self.state.masks
+        popcount = self.state.geometry.popcount
+        for n in range(start, len(candidates)):
+            i = candidates[n]
+            bm = union | masks[i]
+            size = popcount[bm]
+            if size > self.MAX_SUBSET:
+                continue
+            if size == len(members) + 1 and members:
+                found.append((bm, members + [i]))
+            elif size > len(members) + 1:
+                self._find_subsets(
+                    candidates, n + 1, bm, members + [i], found)
@@ -1,7 +1,16 @@
 import random
+import time
+from collections import OrderedDict
+from itertools import izip, combinations
 
 from sudoku_state import (
-    set_N, N_2, N_4, SudokuSquare, StatePrinter, SudokuState, SudokuBoard)
+    set_N, SudokuSquare, StatePrinter, SudokuState, SudokuBoard,
+    RowConstraint, ColumnConstraint, SectorConstraint)
+from sudoku_propagation import ConstraintPropagator
+from sudoku_bitboards import squares, popcount, eliminate
+from dancing_links import SudokuExactCover
+import sudoku_trace
+from sudoku_trace import Guess, Revert, Eliminate, Dissolve
 
 
 class InvalidStateError(Exception):
@@ -30,67 +39,133 @@ class Winner(Exception):
 
 
 class SudokuSolverTechnique:
+    # relative cost, used by TechniqueScheduler to decide what to try first
+    COST = 1
+    # whether a change by this technique leaves the state at its fixpoint,
+    # so applying it again straight away would be a no-op
+    FIXPOINT = False
+    # names of the counts apply_to_state(state, counts) adds to, if any
+    COUNTERS = ()
+
     @classmethod
-    def apply(cls, state):
+    def apply(cls, state, profile=None):
+        """Return the state after this technique, or state if unchanged
+
+        profile: a SolverProfile to record the application in
+        """
         new_state = state.copy(transition_technique=cls)
-        new_state = cls.apply_to_state(new_state)
+        if profile is None:
+            new_state = cls._apply_counting(new_state, None)
+        else:
+            counts = dict.fromkeys(cls.COUNTERS, 0)
+            start = time.time()
+            try:
+                new_state = cls._apply_counting(new_state, counts)
+            finally:
+                profile.record(cls, time.time() - start, state, new_state,
+                               counts)
         if not new_state or new_state == state:
             return state
         return new_state
 
+    @classmethod
+    def _apply_counting(cls, state, counts):
+        if cls.COUNTERS:
+            return cls.apply_to_state(state, counts)
+        return cls.apply_to_state(state)
+
     @classmethod
     def apply_to_state(cls, state):
-        cls.apply_to_sets(state.sets)
-        cls.apply_to_squares(state.squares)
+        cls.apply_to_units(state, state.units)
+        cls.apply_to_squares(state)
         return state
 
     @classmethod
-    def apply_to_sets(cls, sets):
+    def apply_to_units(cls, state, units):
+        """units are the board's tuples of square indexes"""
         pass
 
     @classmethod
-    def apply_to_squares(cls, squares):
+    def apply_to_squares(cls, state):
         pass
 
 
 class ValidatorTechnique(SudokuSolverTechnique):
     @classmethod
-    def apply_to_sets(cls, sets):
-        for sq_set in sets:
-            values = [sq.known_value for sq in sq_set]
-            known_values = [v for v in values if v]
-            # no duplicates
-            if len(set(known_values)) != len(known_values):
-                raise DuplicateValueError(sq_set)
+    def apply_to_units(cls, state, units):
+        masks = state.masks
+        known_value = state.geometry.known_value
+        for unit in units:
+            seen = 0
+            for i in unit:
+                bm = masks[i]
+                if known_value[bm]:
+                    # no duplicates
+                    if seen & bm:
+                        raise DuplicateValueError(
+                            [state.squares[j] for j in unit])
+                    seen |= bm
+
+    @classmethod
+    def apply_to_squares(cls, state):
+        for i, bm in enumerate(state.masks):
+            if bm <= 0:
+                raise ImpossibleValueError(state.squares[i])
 
     @classmethod
-    def apply_to_squares(cls, squares):
-        for sq in squares:
-            if sq.bitmask <= 0:
-                raise ImpossibleValueError(sq)
+    def validate_squares(cls, state, squares):
+        """Check only the given squares and the units containing them
+
+        >>> state = SudokuState.from_string('1...' + '.' * 12)
+        >>> ValidatorTechnique.validate_squares(state, [0])
+        >>> state.squares[15].set_value(1)
+        >>> ValidatorTechnique.validate_squares(state, [15])
+        >>> state.squares[5].set_value(1)
+        >>> ValidatorTechnique.validate_squares(state, [5])
+        Traceback (most recent call last):
+            ...
+        DuplicateValueError
+        """
+        masks = state.masks
+        for i in squares:
+            if masks[i] <= 0:
+                raise ImpossibleValueError(state.squares[i])
+        cell_units = state.board.cell_units
+        units = state.units
+        cls.apply_to_units(state, [
+            units[u] for u in set(u for i in squares for u in cell_units[i])])
 
 
 class WinnerTechnique(SudokuSolverTechnique):
     @classmethod
     def apply(cls, state):
-        if cls.check_sets(state.sets):
+        if cls.check_units(state, state.units):
             return state
         return None
 
     @classmethod
-    def check_sets(cls, sets):
-        for sq_set in sets:
-            values = [sq.known_value for sq in sq_set]
-            known_values = [v for v in values if v]
+    def check_units(cls, state, units):
+        masks = state.masks
+        full = state.geometry.full_bitmask
+        known_value = state.geometry.known_value
+        for unit in units:
+            seen = 0
+            for i in unit:
+                bm = masks[i]
+                if not known_value[bm]:
+                    return False
+                seen |= bm
             # no duplicates
-            if len(set(known_values)) != N_2:
+            if seen != full:
                 return False
         return True
 
 
 class EliminateValues(SudokuSolverTechnique):
+    COST = 2
+
     @classmethod
-    def apply_to_sets(cls, sets):
+    def apply_to_units(cls, state, units):
         """
         >>> set_N(2)
         >>> from sudoku_state import N, N_2, N_3, N_4
@@ -144,91 +219,628 @@ class EliminateValues(SudokuSolverTechnique):
         # 3  | 3  #    |  4 #
         #====+====#====+====#
         """
-        for sq_set in sets:
+        masks = state.masks
+        geometry = state.geometry
+        known_value = geometry.known_value
+        possible_values = geometry.mask_to_values
+        popcount = geometry.popcount
+        for unit in units:
             sqs_with_val = {}
             sqs_by_bitmask = {}
-            for sq in iter(sq_set):
-                for sq2 in iter(sq_set):
-                    if sq2.known_value:
-                        sq.eliminate(sq2)
-
-                pvals = sq.possible_values()
-
-                if sq.bitmask not in sqs_by_bitmask:
-                    sqs_by_bitmask[sq.bitmask] = []
-                sqs_by_bitmask[sq.bitmask].append(sq)
-
-                for val in pvals:
+            for i in unit:
+                bm = masks[i]
+                for j in unit:
+                    other = masks[j]
+                    if j != i and other & bm and known_value[other]:
+                        bm &= ~other
+                if bm != masks[i]:
+                    state.set_bitmask(i, bm)
+
+                if bm not in sqs_by_bitmask:
+                    sqs_by_bitmask[bm] = []
+                sqs_by_bitmask[bm].append(i)
+
+                for val in possible_values[bm]:
                     if val not in sqs_with_val:
                         sqs_with_val[val] = []
-                    sqs_with_val[val].append(sq)
+                    sqs_with_val[val].append(i)
 
-            for val, sqs in sqs_with_val.iteritems():
+            for val, sqs in sorted(sqs_with_val.iteritems()):
                 if len(sqs) == 1:
-                    sqs[0].set_value(val)
+                    state.set_bitmask(
+                        sqs[0], geometry.value_to_bitmask[val])
 
-            for bm, sqs in sqs_by_bitmask.iteritems():
+            for bm, sqs in sorted(sqs_by_bitmask.iteritems()):
                 if len(sqs) > 1:
-                    pvals = list(SudokuSquare.bitmask_to_possible_values(bm))
-                    if len(sqs) == len(pvals):
-                        for sq in iter(sq_set):
-                            if sq not in sqs:
-                                sq.eliminate(sqs[0])
+                    if len(sqs) == popcount[bm]:
+                        subset = masks[sqs[0]]
+                        for i in unit:
+                            if i not in sqs and masks[i] & subset:
+                                state.set_bitmask(i, masks[i] & ~subset)
+
+
+class PropagateConstraints(SudokuSolverTechnique):
+    """EliminateValues' rules run to fixpoint by a ConstraintPropagator.
+
+    Only units around squares that changed since the nearest ancestor state
+    this technique already propagated are revisited. The propagator's visit
+    counts (see ConstraintPropagator) go to the SolverProfile, if any:
+
+    >>> profile = SolverProfile()
+    >>> state = PropagateConstraints.apply(
+    ...     SudokuState.from_string('1..4' + '..1.' + '.4..' + '3..2'),
+    ...     profile=profile)
+    >>> counts = profile.stats['PropagateConstraints'].counts
+    >>> sorted(counts)
+    ['full_sweep_visits', 'unit_visits', 'unit_visits_saved']
+    >>> counts['unit_visits'] + counts['unit_visits_saved'] == (
+    ...     counts['full_sweep_visits'])
+    True
+    """
+    FIXPOINT = True
+    COUNTERS = ('unit_visits', 'full_sweep_visits', 'unit_visits_saved')
 
+    @classmethod
+    def apply_to_state(cls, state, counts=None):
+        propagator = ConstraintPropagator(state)
+        try:
+            if not propagator.propagate(cls._dirty_squares(state)):
+                raise InvalidStateError(state)
+        finally:
+            if counts is not None:
+                for name in cls.COUNTERS:
+                    counts[name] += getattr(propagator, name)
+        state._propagated_hash = hash(state)
+        return state
 
-class GuessAndCheck(SudokuSolverTechnique):
-    MAX_GUESSES = N_4 * N_2
+    @classmethod
+    def _dirty_squares(cls, state):
+        """Squares changed since the last propagated ancestor, or None if
+        there isn't one (or it has been modified since)"""
+        ancestor = state.parent
+        while ancestor is not None:
+            propagated_hash = getattr(ancestor, '_propagated_hash', None)
+            if propagated_hash is not None:
+                if propagated_hash != hash(ancestor):
+                    return None
+                return [i for i, (bm, old_bm) in enumerate(
+                        izip(state.masks, ancestor.masks)) if bm != old_bm]
+            ancestor = ancestor.parent
+        return None
+
+
+class PointingPairs(SudokuSolverTechnique):
+    """If a value's squares in a sector all lie in one other unit, the value
+    can't be anywhere else in that unit (pointing pairs and triples)
+
+    Here 5 is only possible in row 0 of the top left sector, so the rest of
+    row 0 loses it:
+
+    >>> from sudoku_bitboards import eliminated
+    >>> state = SudokuState.from_string('.' * 81)
+    >>> eliminate(state, 5, 0b111 << 9 | 0b111 << 18)
+    True
+    >>> eliminated(state, PointingPairs.apply(state))
+    [(3, (5,)), (4, (5,)), (5, (5,)), (6, (5,)), (7, (5,)), (8, (5,))]
+    """
+    COST = 3
+
+    @classmethod
+    def apply_to_state(cls, state):
+        unit_constraints = state.board.unit_constraints
+        cls._apply_to_intersections(state, [
+            (a, b, mask) for a, b, mask in state.board.intersections
+            if unit_constraints[a] is SectorConstraint])
+        return state
+
+    @classmethod
+    def _apply_to_intersections(cls, state, intersections):
+        """For each (a, b, mask): a value only possible inside mask within
+        unit a is removed from the rest of unit b"""
+        boards = state.digits
+        unit_masks = state.board.unit_masks
+        for v in range(1, state.geometry.N_2 + 1):
+            for a, b, mask in intersections:
+                in_a = boards[v] & unit_masks[a]
+                if in_a and not in_a & ~mask:
+                    rest = boards[v] & unit_masks[b] & ~mask
+                    if rest:
+                        eliminate(state, v, rest)
+
+
+class BoxLineReduction(PointingPairs):
+    """If a value's squares in a row, column (or X/Meta region) all lie in
+    one sector, the value can't be anywhere else in that sector
+
+    Here 5 is only possible in the first three squares of row 0, so the
+    rest of the top left sector loses it:
+
+    >>> from sudoku_bitboards import eliminated
+    >>> state = SudokuState.from_string('.' * 81)
+    >>> eliminate(state, 5, 0b111111000)
+    True
+    >>> eliminated(state, BoxLineReduction.apply(state))
+    [(9, (5,)), (10, (5,)), (11, (5,)), (18, (5,)), (19, (5,)), (20, (5,))]
+    """
+    COST = 3
 
     @classmethod
     def apply_to_state(cls, state):
-        shuffled_sqs = list(state.squares)
-        random.shuffle(shuffled_sqs)
-        for sq in sorted(
-                shuffled_sqs, key=lambda s: len(list(s.possible_values()))):
-            pvals = list(sq.possible_values())
-            if len(pvals) > 1:
-                random.shuffle(pvals)
-                for pval in pvals:
-                    finstate = cls.try_pval(state, sq, pval)
-                    if finstate:
-                        if WinnerTechnique.apply(finstate):
-                            return finstate
-                    else:
-                        print "Determined {!r} != {}".format(sq, pval)
-                        sq.eliminate(SudokuSquare(value=pval))
-                        print "(now {!r})".format(sq, pval)
+        unit_constraints = state.board.unit_constraints
+        cls._apply_to_intersections(state, [
+            (a, b, mask) for a, b, mask in state.board.intersections
+            if unit_constraints[a] is not SectorConstraint])
         return state
 
+
+class HiddenSubsets(SudokuSolverTechnique):
+    """If k values in a unit are only possible in the same k squares, those
+    squares can't hold anything else (hidden pairs, triples and quads)
+
+    Here 1, 2 and 3 are only possible in squares 0, 1 and 2 of row 0:
+
+    >>> from sudoku_bitboards import eliminated
+    >>> state = SudokuState.from_string('.' * 81)
+    >>> for v in 1, 2, 3:
+    ...     eliminate(state, v, 0b111111000)
+    True
+    True
+    True
+    >>> eliminated(state, HiddenSubsets.apply(state))
+    [(0, (4, 5, 6, 7, 8, 9)), (1, (4, 5, 6, 7, 8, 9)), (2, (4, 5, 6, 7, 8, 9))]
+    """
+    COST = 4
+    MAX_SIZE = 4
+
     @classmethod
-    def try_pval(cls, state, sq, value):
-        original_bitmask = sq.bitmask
+    def apply_to_state(cls, state):
+        boards = state.digits
+        masks = state.masks
+        value_to_bitmask = state.geometry.value_to_bitmask
+        for unit_mask in state.board.unit_masks:
+            places = [(v, boards[v] & unit_mask)
+                      for v in range(1, state.geometry.N_2 + 1)]
+            places = [(v, board) for v, board in places
+                      if 1 < popcount(board) <= cls.MAX_SIZE]
+            for size in range(2, min(cls.MAX_SIZE, len(places)) + 1):
+                for subset in combinations(places, size):
+                    board = 0
+                    for v, places_v in subset:
+                        board |= places_v
+                    if popcount(board) != size:
+                        continue
+                    keep = sum(value_to_bitmask[v] for v, places_v in subset)
+                    for i in squares(board):
+                        if masks[i] & ~keep:
+                            state.set_bitmask(i, masks[i] & keep)
+        return state
+
+
+class XWing(SudokuSolverTechnique):
+    """If a value's squares in SIZE rows all lie in the same SIZE columns,
+    it can't be anywhere else in those columns (and the same with rows and
+    columns swapped)
+
+    Here 1 is only possible in columns 1 and 3 of rows 0 and 2, so rows 1
+    and 3 lose it in those columns:
+
+    >>> from sudoku_bitboards import eliminated
+    >>> state = SudokuState.from_string('.' * 16)
+    >>> eliminate(state, 1, 0b0101 | 0b0101 << 8)
+    True
+    >>> eliminated(state, XWing.apply(state))
+    [(5, (1,)), (7, (1,)), (13, (1,)), (15, (1,))]
+    """
+    COST = 5
+    SIZE = 2
+
+    @classmethod
+    def apply_to_state(cls, state):
+        board = state.board
+        rows = [board.unit_masks[u] for u, c in
+                enumerate(board.unit_constraints) if c is RowConstraint]
+        columns = [board.unit_masks[u] for u, c in
+                   enumerate(board.unit_constraints) if c is ColumnConstraint]
+        boards = state.digits
+        for v in range(1, state.geometry.N_2 + 1):
+            for base, cover in ((rows, columns), (columns, rows)):
+                cls._find_fish(state, v, boards, base, cover)
+        return state
+
+    @classmethod
+    def _find_fish(cls, state, v, boards, base, cover):
+        # for each base line, the cover lines its squares for v are in
+        lines = []
+        for b, base_mask in enumerate(base):
+            hits = 0
+            for c, cover_mask in enumerate(cover):
+                if boards[v] & base_mask & cover_mask:
+                    hits |= 1 << c
+            if 1 < popcount(hits) <= cls.SIZE:
+                lines.append((base_mask, hits))
+        for fish in combinations(lines, cls.SIZE):
+            base_squares = hits = 0
+            for base_mask, line_hits in fish:
+                base_squares |= base_mask
+                hits |= line_hits
+            if popcount(hits) == cls.SIZE:
+                for c in squares(hits):
+                    rest = boards[v] & cover[c] & ~base_squares
+                    if rest:
+                        eliminate(state, v, rest)
+
+
+class Swordfish(XWing):
+    """XWing with three rows and three columns
+
+    Here 1 is only possible in columns 0 and 4 of row 0, 4 and 8 of row 3
+    and 0 and 8 of row 6, so the other rows lose it in columns 0, 4 and 8:
+
+    >>> from sudoku_bitboards import eliminated
+    >>> state = SudokuState.from_string('.' * 81)
+    >>> fish = {0: 0b000010001, 3: 0b100010000, 6: 0b100000001}
+    >>> for row, columns in sorted(fish.items()):
+    ...     eliminate(state, 1, (0b111111111 & ~columns) << 9 * row)
+    True
+    True
+    True
+    >>> removed = eliminated(state, Swordfish.apply(state))
+    >>> [i for i, values in removed]  # doctest: +NORMALIZE_WHITESPACE
+    [9, 13, 17, 18, 22, 26, 36, 40, 44, 45, 49, 53,
+     63, 67, 71, 72, 76, 80]
+    >>> set(values for i, values in removed)
+    set([(1,)])
+    """
+    COST = 6
+    SIZE = 3
+
+
+class XYWing(SudokuSolverTechnique):
+    """A pivot square that can only be x or y, seeing a square that can
+    only be x or z and one that can only be y or z: either way one of those
+    two is z, so squares seeing both of them can't be z
+
+    Here the pivot is square 0 (1 or 2), with wings square 4 (1 or 3) in
+    its row and square 36 (2 or 3) in its column; square 40 sees both wings:
+
+    >>> from sudoku_bitboards import eliminated
+    >>> state = SudokuState.from_string('.' * 81)
+    >>> state.set_bitmask(0, 0b011)
+    >>> state.set_bitmask(4, 0b101)
+    >>> state.set_bitmask(36, 0b110)
+    >>> eliminated(state, XYWing.apply(state))
+    [(40, (3,))]
+    """
+    COST = 6
+
+    @classmethod
+    def apply_to_state(cls, state):
+        masks = state.masks
+        count = state.geometry.popcount
+        known_value = state.geometry.known_value
+        peer_masks = state.board.peer_masks
+        boards = state.digits
+        bivalue = 0
+        for i, bm in enumerate(masks):
+            if count[bm] == 2:
+                bivalue |= 1 << i
+        for pivot in squares(bivalue):
+            xy = masks[pivot]
+            if count[xy] != 2:
+                continue
+            wings = [i for i in squares(peer_masks[pivot] & bivalue)
+                     if count[masks[i]] == 2 and count[masks[i] & xy] == 1]
+            for a, b in combinations(wings, 2):
+                xz, yz = masks[a], masks[b]
+                z = xz & yz
+                if (xz | yz) & xy != xy or count[z] != 1 or z & xy:
+                    continue
+                rest = (peer_masks[a] & peer_masks[b] &
+                        boards[known_value[z]])
+                if rest:
+                    eliminate(state, known_value[z], rest)
+        return state
+
+
+# the bitwise techniques, cheapest first
+ADVANCED_TECHNIQUES = (
+    PointingPairs, BoxLineReduction, HiddenSubsets, XWing, Swordfish,
+    XYWing)
+
+
+class GuessAndCheck(SudokuSolverTechnique):
+    """Depth-first search on one state, undoing guesses through its trail
+
+    Each node guesses a value for the open square with the fewest possible
+    values and propagates from just that square; a contradiction rolls the
+    trail back to where the guess was made. A node costs the changes it
+    makes rather than a state copy and a nested solver. Each guess and
+    revert is sent to the trace sink. Counts go to the SolverProfile, if
+    any:
+
+        nodes: guesses made
+        backtracks: guesses undone
+
+    >>> profile = SolverProfile()
+    >>> state = SudokuState.from_string(
+    ...     '4.....8.5.3..........7......2.....6.....8.4......1.......6.3.'
+    ...     '7.5..2.....1.4......')
+    >>> solved = GuessAndCheck.apply(state, profile=profile)
+    >>> bool(WinnerTechnique.apply(solved)), solved.trail
+    (True, None)
+    >>> StatePrinter.get_playable_state(solved)[:27]
+    '417369825632158947958724316'
+    >>> sorted(profile.stats['GuessAndCheck'].counts.items())
+    [('backtracks', 0), ('nodes', 1)]
+    >>> GuessAndCheck.apply(SudokuState.from_string('11' + '.' * 79))
+    Traceback (most recent call last):
+        ...
+    InvalidStateError
+    """
+    COST = 50
+    FIXPOINT = True
+    COUNTERS = ('nodes', 'backtracks')
+
+    @classmethod
+    def apply_to_state(cls, state, counts=None):
+        if counts is None:
+            counts = dict.fromkeys(cls.COUNTERS, 0)
+        state.trail = []
         try:
-            print "Trying {!r} = {}".format(sq, value)
-            new_state = state.copy()
-            new_state.squares[sq._id].set_value(value)
-            solver = SudokuSolver(new_state)
-            final_state = None
-            for final_state in solver.solve_iter():
-                print final_state.transition_technique
-                StatePrinter.print_state_and_ancestor(final_state)
-            return final_state
-        except InvalidStateError:
-            return None
+            propagator = ConstraintPropagator(state)
+            if (propagator.propagate() and
+                    cls._search(state, propagator, sudoku_trace.sink, 1,
+                                counts)):
+                return state
         finally:
-            sq.set_bitmask(original_bitmask)
-            print "Reverted {!r}".format(sq)
+            state.trail = None
+        raise InvalidStateError(state)
+
+    @classmethod
+    def _search(cls, state, propagator, sink, depth, counts):
+        """Return True with state solved, or False with it as it was"""
+        masks = state.masks
+        popcount = state.geometry.popcount
+        best = None
+        fewest = state.geometry.N_2 + 1
+        for i, bm in enumerate(masks):
+            count = popcount[bm]
+            if 1 < count < fewest:
+                best, fewest = i, count
+                if count == 2:
+                    break
+        if best is None:
+            # propagation rules out duplicates, so a full board is a win
+            return True
+
+        trail = state.trail
+        for value in state.geometry.mask_to_values[masks[best]]:
+            counts['nodes'] += 1
+            if sink.level <= Guess.level:
+                sink.emit(Guess(best, value, depth))
+            mark = len(trail)
+            state.set_bitmask(best, state.geometry.value_to_bitmask[value])
+            if (propagator.propagate([best]) and
+                    cls._search(state, propagator, sink, depth + 1,
+                                counts)):
+                return True
+            counts['backtracks'] += 1
+            if sink.level <= Revert.level:
+                sink.emit(Revert(best, value, depth))
+            state.undo(mark)
+        return False
+
+
+class ExactCover(SudokuSolverTechnique):
+    """Finish the state with Dancing Links instead of guessing
+
+    Unlike GuessAndCheck, search happens on one exact cover matrix with no
+    state copies or nested solvers. If there are several solutions, the
+    first one found wins.
+
+    >>> set_N(2)
+    >>> state = SudokuState(board=SudokuBoard(meta_regions=True))
+    >>> state.squares[0].set_value(4)
+    >>> solved = ExactCover.apply(state)
+    >>> solved.transition_technique.__name__
+    'ExactCover'
+    >>> bool(WinnerTechnique.apply(solved))
+    True
+    >>> state.squares[1].set_value(4)
+    >>> ExactCover.apply(state)
+    Traceback (most recent call last):
+        ...
+    InvalidStateError
+    """
+    COST = 20
+    FIXPOINT = True
+
+    @classmethod
+    def apply_to_state(cls, state):
+        solved = SudokuExactCover(state).first_state()
+        if not solved:
+            raise InvalidStateError(state)
+        for i, bm in enumerate(solved.masks):
+            state.set_bitmask(i, bm)
+        return state
+
+
+class TechniqueStats(object):
+    __slots__ = ('cost', 'calls', 'seconds', 'eliminated', 'solved',
+                 'counts')
+
+    def __init__(self, cost=1):
+        self.cost = cost
+        self.calls = 0
+        self.seconds = 0.0
+        self.eliminated = 0
+        self.solved = 0
+        self.counts = {}
+
+
+class SolverProfile(object):
+    """Per-technique counters, filled in by SudokuSolverTechnique.apply
+
+        calls: applications
+        seconds: wall time spent in them
+        eliminated: candidates removed
+        solved: squares that went from unknown to known
+        counts: the technique's own COUNTERS, by name
+
+    One profile can be shared by many solvers to sum over a corpus.
+
+    >>> profile = SolverProfile()
+    >>> state = SudokuState.from_string(
+    ...     '4.....8.5.3..........7......2.....6.....8.4......1.......6.3.'
+    ...     '7.5..2.....1.4......')
+    >>> solved = SudokuSolver(state, enable_guessing=True, advanced=False,
+    ...                       profile=profile).solve()
+    >>> list(profile.stats)
+    ['PropagateConstraints', 'GuessAndCheck']
+    >>> stats = profile.stats['PropagateConstraints']
+    >>> stats.calls, stats.eliminated, stats.solved
+    (2, 326, 4)
+    >>> print profile.report()  # doctest: +ELLIPSIS
+    technique               calls   seconds  eliminated  solved
+    PropagateConstraints        2  ...         326       4
+    GuessAndCheck               1  ...         186      60
+    >>> profile.rating() == GuessAndCheck.COST
+    True
+    >>> profile.count('GuessAndCheck', 'nodes'), profile.count('XWing', 'x')
+    (1, 0)
+    """
+    def __init__(self):
+        self.stats = OrderedDict()
+
+    def record(self, technique, seconds, before, after, counts=None):
+        stats = self.stats.get(technique.__name__)
+        if stats is None:
+            stats = self.stats[technique.__name__] = TechniqueStats(
+                technique.COST)
+        stats.calls += 1
+        stats.seconds += seconds
+        if counts:
+            for name, count in counts.iteritems():
+                stats.counts[name] = stats.counts.get(name, 0) + count
+        if not after:
+            return
+        popcount = before.geometry.popcount
+        for old_bm, bm in izip(before.masks, after.masks):
+            if old_bm != bm:
+                stats.eliminated += popcount[old_bm] - popcount[bm]
+                if popcount[bm] == 1 and popcount[old_bm] > 1:
+                    stats.solved += 1
+
+    def count(self, technique_name, counter):
+        """A technique's total for one of its COUNTERS, 0 if it never ran"""
+        stats = self.stats.get(technique_name)
+        return stats.counts.get(counter, 0) if stats else 0
+
+    def rating(self):
+        """The COST of the dearest technique that eliminated anything"""
+        return max([stats.cost for stats in self.stats.itervalues()
+                    if stats.eliminated] or [0])
+
+    def report(self):
+        lines = ['{:<22} {:>6} {:>9} {:>11} {:>7}'.format(
+            'technique', 'calls', 'seconds', 'eliminated', 'solved')]
+        for name, stats in self.stats.iteritems():
+            lines.append('{:<22} {:>6} {:>9.4f} {:>11} {:>7}'.format(
+                name, stats.calls, stats.seconds, stats.eliminated,
+                stats.solved))
+        return '\n'.join(lines)
+
+
+class TechniqueScheduler(object):
+    """Picks the order SudokuSolver tries its techniques in
+
+    Techniques are tried cheapest COST first, so cheap ones always reach
+    their fixpoint before anything more expensive runs. Techniques of equal
+    cost are ordered by recent yield: a moving average of the candidates
+    each call eliminated. A technique isn't retried on a state it has
+    already left unchanged (or, for FIXPOINT techniques, produced).
+
+    >>> scheduler = TechniqueScheduler([GuessAndCheck, EliminateValues,
+    ...                                 PropagateConstraints])
+    >>> [t.__name__ for t in scheduler.order()]
+    ['PropagateConstraints', 'EliminateValues', 'GuessAndCheck']
+    >>> scheduler.record(EliminateValues, 10)
+    >>> scheduler.yields[EliminateValues]
+    5.0
+    """
+    DECAY = 0.5
+
+    def __init__(self, techniques):
+        self.techniques = list(techniques)
+        self.yields = dict((t, 0.0) for t in self.techniques)
+        self._idle_at = {}
+
+    def order(self):
+        return sorted(self.techniques,
+                      key=lambda t: (t.COST, -self.yields[t]))
+
+    def is_idle(self, technique, state):
+        return self._idle_at.get(technique) == hash(state)
+
+    def record(self, technique, eliminated, state=None):
+        """Note a call that eliminated candidates, leaving state"""
+        self.yields[technique] = (
+            self.DECAY * self.yields[technique] +
+            (1 - self.DECAY) * eliminated)
+        if state is not None and (not eliminated or technique.FIXPOINT):
+            self._idle_at[technique] = hash(state)
 
 
 class SudokuSolver:
-    def __init__(self, initial_state, enable_guessing=False, ):
+    """Applies techniques to a state until none of them change it
+
+    schedule:
+        'fixed': every step restarts from the first technique, and
+            ValidatorTechnique checks the whole board each time
+        'adaptive': a TechniqueScheduler orders the techniques, and only
+            squares that changed are validated
+
+    >>> puzzle = ('4.....8.5.3..........7......2.....6.....8.4......1......'
+    ...           '.6.3.7.5..2.....1.4......')
+    >>> solutions = [
+    ...     SudokuSolver(SudokuState.from_string(puzzle),
+    ...                  enable_guessing=True, schedule=schedule).solve()
+    ...     for schedule in SudokuSolver.SCHEDULES]
+    >>> solutions[0] == solutions[1], bool(WinnerTechnique.apply(solutions[1]))
+    (True, True)
+    """
+    SCHEDULES = ('fixed', 'adaptive')
+
+    def __init__(self, initial_state, enable_guessing=False,
+                 incremental=True, exact_cover=False, profile=None,
+                 schedule='adaptive', advanced=True):
+        """advanced: use the ADVANCED_TECHNIQUES before any guessing
+        exact_cover: finish with ExactCover rather than GuessAndCheck
+        profile: True or a SolverProfile to record technique stats in; it is
+            available as self.profile
+        schedule: one of SCHEDULES
+        """
+        if schedule not in self.SCHEDULES:
+            raise ValueError("Unknown schedule {!r}".format(schedule))
         self._initial_state = initial_state
         self._current_state = initial_state
+        if profile is True:
+            profile = SolverProfile()
+        self.profile = profile or None
+        self.schedule = schedule
         self._techniques = [
             ValidatorTechnique,
-            EliminateValues
+            PropagateConstraints if incremental else EliminateValues
         ]
-        if enable_guessing:
+        if advanced:
+            self._techniques.extend(ADVANCED_TECHNIQUES)
+        if exact_cover:
+            self._techniques.append(ExactCover)
+        elif enable_guessing:
             self._techniques.append(GuessAndCheck)
+        self._scheduler = TechniqueScheduler(
+            [t for t in self._techniques if t is not ValidatorTechnique])
+        self._validated = False
 
     def solve(self):
         for state in self.solve_iter():
@@ -243,13 +855,74 @@ class SudokuSolver:
             yield self._current_state
 
     def _solve_step(self):
+        if self.schedule == 'adaptive':
+            return self._adaptive_step()
         prev_state = self._current_state
         for t in self._techniques:
-            self._current_state = t.apply(prev_state)
+            self._current_state = t.apply(prev_state, profile=self.profile)
             if self._current_state != prev_state:
+                self._trace(t, prev_state, self._current_state)
                 return self._current_state
         return prev_state
 
+    def _adaptive_step(self):
+        prev_state = self._current_state
+        if not self._validated:
+            ValidatorTechnique.apply_to_state(prev_state)
+            self._validated = True
+        scheduler = self._scheduler
+        for t in scheduler.order():
+            if scheduler.is_idle(t, prev_state):
+                continue
+            state = t.apply(prev_state, profile=self.profile)
+            if state == prev_state:
+                scheduler.record(t, 0, prev_state)
+                continue
+            changed, eliminated = self._changes(prev_state, state)
+            ValidatorTechnique.validate_squares(state, changed)
+            scheduler.record(t, eliminated, state)
+            self._trace(t, prev_state, state)
+            self._current_state = state
+            return state
+        return prev_state
+
+    @classmethod
+    def _changes(cls, prev_state, state):
+        """Return the squares that changed and the candidates removed"""
+        popcount = state.geometry.popcount
+        changed = []
+        eliminated = 0
+        for i, (old_bm, bm) in enumerate(izip(prev_state.masks, state.masks)):
+            if old_bm != bm:
+                changed.append(i)
+                eliminated += popcount[old_bm] - popcount[bm]
+        return changed, eliminated
+
+    @classmethod
+    def _trace(cls, technique, prev_state, state):
+        sink = sudoku_trace.sink
+        if sink.level <= Eliminate.level:
+            changed, eliminated = cls._changes(prev_state, state)
+            sink.emit(Eliminate(technique.__name__, len(changed), eliminated))
+
+
+def count_solutions(state, limit=2):
+    """Count the solutions of state, stopping once limit are found
+
+    Every alternate value of every open square is explored by the same exact
+    cover search, so a uniqueness check costs one search that ends as soon as
+    a second solution turns up.
+
+    >>> puzzle = SudokuState.from_string('1234' + '.' * 12)
+    >>> count_solutions(puzzle), count_solutions(puzzle, limit=None)
+    (2, 12)
+    >>> count_solutions(SudokuState.from_string('1234341243212143'))
+    1
+    >>> count_solutions(SudokuState.from_string('11' + '.' * 14))
+    0
+    """
+    return SudokuExactCover(state).count(limit)
+
 
 class SudokuGenerator:
 
@@ -258,51 +931,34 @@ class SudokuGenerator:
         return [sq for sq in state.squares if sq.known_value]
 
     @classmethod
-    def generate_puzzle(cls):
-        solution = cls.generate_solved_puzzle()
-        print "Got solved puzzle!"
-        StatePrinter.print_board_state(solution, color=True)
+    def generate_puzzle(cls, board=None):
+        """Return a puzzle with a unique solution, as a playable string
+
+        Each attempt to remove a given is sent to the trace sink as a
+        Dissolve event.
+        """
+        solution = cls.generate_solved_puzzle(board)
         puzzle = solution.copy()
 
         try:
             required_squares = set()
             while set(SudokuGenerator.solved_squares(puzzle)) > required_squares:
-                StatePrinter.print_board_state(puzzle, color=True)
-                StatePrinter.print_playable_state(puzzle)
                 sq = random.choice(SudokuGenerator.solved_squares(puzzle))
-                print "Attempting to dissolve {}".format(sq)
-                sq_val = sq.known_value
-                alternate_solution = None
-                for i in range(1, N_2 + 1):
-                    if i == sq_val:
-                        continue
-                    alternate_state = puzzle.copy(
-                        transition_technique="test_alternate")
-                    alternate_state.squares[sq.id].set_value(i)
-                    solver = SudokuSolver(alternate_state, enable_guessing=True)
-                    try:
-                        alternate_solution = solver.solve()
-                    except InvalidStateError:
-                        continue
-                    if (alternate_solution
-                            and WinnerTechnique.apply(alternate_solution)
-                            and alternate_solution != solution):
-                        # uh oh
-                        break
-                if (alternate_solution
-                        and WinnerTechnique.apply(alternate_solution)
-                        and alternate_solution != solution):
-                    # this square is important, so keep it
-                    print "Nope, we need {}".format(sq)
-                    required_squares.add(sq)
-                else:
-                    # the puzzle is only solvable when sq == sq_val, so we don't
+                candidate = puzzle.copy(
+                    transition_technique="eliminate_redundant")
+                candidate.squares[sq.id].set_value(None)
+                removed = count_solutions(candidate) == 1
+                sink = sudoku_trace.sink
+                if sink.level <= Dissolve.level:
+                    sink.emit(Dissolve(sq.id, sq.known_value, removed))
+                if removed:
+                    # the solution is still unique without sq, so we don't
                     # need it
-                    print "dissolving redundant square {}".format(sq)
-                    puzzle = puzzle.copy(
-                        transition_technique="eliminate_redundant")
-                    puzzle.squares[sq.id].set_value(None)
+                    puzzle = candidate
                     required_squares = set()
+                else:
+                    # this square is important, so keep it
+                    required_squares.add(sq)
         except KeyboardInterrupt as e:
             print "Error: {}".format(e)
             return StatePrinter.get_playable_state(puzzle)
@@ -310,25 +966,13 @@ class SudokuGenerator:
         return StatePrinter.get_playable_state(puzzle)
 
     @classmethod
-    def generate_solved_puzzle(cls):
+    def generate_solved_puzzle(cls, board=None):
         """
 
         """
-        board = SudokuBoard()
-        state = SudokuState(board=board)
-
-        while not WinnerTechnique.apply(state):
-            StatePrinter.print_board_state(state, color=True)
-            sq = random.choice(state.squares)
-            if not sq.known_value:
-                for value in sq.possible_values():
-                    new_state = GuessAndCheck.try_pval(state, sq, value)
-                    if new_state:
-                        state = new_state
-                        break
-            solver = SudokuSolver(state, enable_guessing=False)
-            state = solver.solve()
-        return state
+        state = SudokuState(board=board or SudokuBoard())
+        # shuffled rows make the first exact cover a random solved grid
+        return SudokuExactCover(state, random).first_state()
 
 
 if __name__ == "__main__":
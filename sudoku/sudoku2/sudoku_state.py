@@ -1,15 +1,130 @@
+import random
 import sys
+from array import array
 from termcolor import colored
 
-global N, N_2, N_3, N_4
+global N, N_2, N_3, N_4, GEOMETRY
+global VALUE_TO_BITMASK, FULL_BITMASK, POPCOUNT, KNOWN_VALUE, MASK_TO_VALUES
+
+# the values of N a state can hold: N_2 bits of mask per square fit in 16
+SIZES = (2, 3, 4)
+
+
+class SudokuGeometry(object):
+    """Everything that depends on the board size, for one value of N.
+
+    Boards and states carry their own geometry, so puzzles of different sizes
+    can be solved side by side. Geometries are immutable and cached; get them
+    with SudokuGeometry.for_size().
+
+    >>> g = SudokuGeometry.for_size(2)
+    >>> g is SudokuGeometry.for_size(2)
+    True
+    >>> g.N_2, g.N_4, g.full_bitmask, g.value_to_bitmask
+    (4, 16, 15, (0, 1, 2, 4, 8))
+    >>> g.popcount[0b1011], g.known_value[0b0100], g.known_value[0b0101]
+    (3, 3, None)
+    >>> g.mask_to_values[0b1101]
+    (1, 3, 4)
+    >>> SudokuGeometry.for_size(4).mask_to_values[0xffff][-1]
+    16
+    """
+    _cache = {}
+
+    @classmethod
+    def for_size(cls, n):
+        if n not in cls._cache:
+            cls._cache[n] = cls(n)
+        return cls._cache[n]
+
+    def __init__(self, n):
+        self.N = n               # 2  # 3
+        self.N_2 = n * n         # 4  # 9
+        self.N_3 = self.N_2 * n  # 8  # 27
+        self.N_4 = self.N_3 * n  # 16 # 81
+        self._build_bitmask_tables()
+        self._build_zobrist_tables()
+
+    def _build_bitmask_tables(self):
+        """Precompute the bitmask helpers for every possible N_2-bit mask"""
+        self.value_to_bitmask = (0,) + tuple(1 << v for v in range(self.N_2))
+        self.full_bitmask = full = (1 << self.N_2) - 1
+
+        popcount = [0] * (full + 1)
+        known_value = [None] * (full + 1)
+        mask_to_values = [()] * (full + 1)
+        for v in range(1, self.N_2 + 1):
+            known_value[self.value_to_bitmask[v]] = v
+        for mask in range(1, full + 1):
+            # values[mask] is values[mask without its lowest bit] plus that bit
+            rest = mask & (mask - 1)
+            popcount[mask] = popcount[rest] + 1
+            mask_to_values[mask] = (
+                (known_value[mask ^ rest],) + mask_to_values[rest])
+        self.popcount = tuple(popcount)
+        self.known_value = tuple(known_value)
+        self.mask_to_values = tuple(mask_to_values)
+
+    def _build_zobrist_tables(self):
+        """Random keys for each (square, value) pair, combined per byte of mask
+
+        A square's key for a whole bitmask is the xor of its per-value keys,
+        split into low and high bytes so the tables stay small for N = 4:
+
+            zobrist_lo[i][mask & 0xff] ^ zobrist_hi[i][mask >> 8]
+
+        The generator is seeded so hashes are stable between processes.
+        """
+        rng = random.Random(self.N)
+        lo, hi = [], []
+        for i in range(self.N_4):
+            keys = [rng.getrandbits(62) for v in range(self.N_2)]
+            lo.append(_xor_table(keys[:8]))
+            hi.append(_xor_table(keys[8:]))
+        self.zobrist_lo = tuple(lo)
+        self.zobrist_hi = tuple(hi)
+
+    def zobrist_key(self, index, bitmask):
+        return (self.zobrist_lo[index][bitmask & 0xff] ^
+                self.zobrist_hi[index][bitmask >> 8])
+
+    def square_index(self, x, y):
+        return y * self.N_2 + x
+
+    def __repr__(self):
+        return "SudokuGeometry({})".format(self.N)
+
+
+def _xor_table(keys):
+    table = [0] * (1 << len(keys))
+    for mask in range(1, len(table)):
+        rest = mask & (mask - 1)
+        table[mask] = table[rest] ^ keys[(mask ^ rest).bit_length() - 1]
+    return tuple(table)
 
 
 def set_N(n=2):
-    global N, N_2, N_3, N_4
-    N = n          # 2  # 3
-    N_2 = N * N    # 4  # 9
-    N_3 = N_2 * N  # 8  # 27
-    N_4 = N_3 * N  # 16 # 81
+    """Set the default geometry, used when a board or square isn't given one
+
+    The module-level N, N_2, ... and lookup tables mirror it.
+
+    >>> set_N(2)
+    >>> GEOMETRY, N_4, FULL_BITMASK, MASK_TO_VALUES[0b1101]
+    (SudokuGeometry(2), 16, 15, (1, 3, 4))
+    """
+    global N, N_2, N_3, N_4, GEOMETRY
+    global VALUE_TO_BITMASK, FULL_BITMASK
+    global POPCOUNT, KNOWN_VALUE, MASK_TO_VALUES
+    GEOMETRY = SudokuGeometry.for_size(n)
+    N = GEOMETRY.N
+    N_2 = GEOMETRY.N_2
+    N_3 = GEOMETRY.N_3
+    N_4 = GEOMETRY.N_4
+    VALUE_TO_BITMASK = GEOMETRY.value_to_bitmask
+    FULL_BITMASK = GEOMETRY.full_bitmask
+    POPCOUNT = GEOMETRY.popcount
+    KNOWN_VALUE = GEOMETRY.known_value
+    MASK_TO_VALUES = GEOMETRY.mask_to_values
 
 
 try:
@@ -19,8 +134,20 @@ except Exception:
     set_N(2)
 
 
-class SudokuSquare:
-    def __init__(self, value=None, bitmask=None, id=None, frozen=False):
+class SudokuSquare(object):
+    """A single square's possible values.
+
+    A square either owns its bitmask (when built directly) or is a view onto
+    one slot of a SudokuState's packed mask buffer (see SudokuState.squares),
+    in which case changes are written straight through to the state.
+
+    The classmethod bitmask helpers use the default geometry (see set_N);
+    a square's own methods use the geometry of the state it belongs to.
+    """
+    __slots__ = ('_id', '_state', '_masks', '_givens', '_index', '_geometry')
+
+    def __init__(self, value=None, bitmask=None, id=None, frozen=False,
+                 geometry=None):
         """
         >>> set_N(2)
         >>> global N, N_2, N_3, N_4
@@ -28,14 +155,39 @@ class SudokuSquare:
         sq#None 1234
         """
         self._id = id
+        self._state = None
+        self._masks = [0]
+        self._givens = bytearray(1)
+        self._index = 0
+        self._geometry = geometry or GEOMETRY
 
         if value:
             self.set_value(value)
         elif bitmask:
-            self._value_bitmask = int(bitmask)
+            self._masks[0] = int(bitmask)
         else:
-            self._value_bitmask = self.full_bitmask()
-        self.frozen = frozen and self.known_value
+            self._masks[0] = self._geometry.full_bitmask
+        self._givens[0] = 1 if frozen and self.known_value else 0
+
+    @classmethod
+    def view(cls, state, index):
+        """A square backed by slot `index` of `state`'s mask buffer"""
+        sq = cls.__new__(cls)
+        sq._id = index
+        sq._state = state
+        sq._masks = state._masks
+        sq._givens = state._givens
+        sq._index = index
+        sq._geometry = state.geometry
+        return sq
+
+    @property
+    def geometry(self):
+        return self._geometry
+
+    @property
+    def frozen(self):
+        return bool(self._givens[self._index])
 
     @property
     def id(self):
@@ -43,7 +195,7 @@ class SudokuSquare:
 
     @property
     def bitmask(self):
-        return int(self._value_bitmask)
+        return self._masks[self._index]
 
     @classmethod
     def value_to_bitmask(cls, value):
@@ -56,50 +208,56 @@ class SudokuSquare:
         >>> int(SudokuSquare.value_to_bitmask(3))
         4
         """
-        return int(2 ** (value - 1))
+        return VALUE_TO_BITMASK[value]
 
     @classmethod
     def bitmask_to_known_value(cls, bmask):
         """
         >>> SudokuSquare.bitmask_to_known_value(0b0100)
         3
+        >>> SudokuSquare.bitmask_to_known_value(0b0110)
         """
-        v = int(bmask).bit_length()
-        if cls.value_to_bitmask(v) != bmask:
-            return None
-        return v
+        return KNOWN_VALUE[bmask]
+
+    @classmethod
+    def bitmask_popcount(cls, bmask):
+        """
+        >>> SudokuSquare.bitmask_popcount(0b0110)
+        2
+        """
+        return POPCOUNT[bmask]
 
     @classmethod
     def full_bitmask(cls):
-        return sum([SudokuSquare.value_to_bitmask(i + 1) for i in range(N_2)])
+        return FULL_BITMASK
 
     @property
     def known_value(self):
-        return self.bitmask_to_known_value(self.bitmask)
+        return self._geometry.known_value[self.bitmask]
 
     def set_value(self, value):
         if value and value > 0:
-            self._value_bitmask = SudokuSquare.value_to_bitmask(value)
+            self.set_bitmask(self._geometry.value_to_bitmask[value])
         else:
-            self._value_bitmask = self.full_bitmask()
+            self.set_bitmask(self._geometry.full_bitmask)
 
     def set_bitmask(self, bitmask):
-        self._value_bitmask = bitmask
+        if self._state is not None:
+            self._state.set_bitmask(self._index, bitmask)
+        else:
+            self._masks[0] = bitmask
 
     def __and__(self, other):
         if isinstance(other, SudokuSquare):
-            return int(self.bitmask & other._value_bitmask)
-        return int(self.bitmask & SudokuSquare.value_to_bitmask(other))
+            return int(self.bitmask & other.bitmask)
+        return int(self.bitmask & self._geometry.value_to_bitmask[other])
 
     @classmethod
     def bitmask_to_possible_values(cls, bmask):
-        for i in range(N_2):
-            mask = SudokuSquare.value_to_bitmask(i + 1)
-            if mask & bmask == mask:
-                yield i + 1
+        return MASK_TO_VALUES[bmask]
 
     def possible_values(self):
-        return self.bitmask_to_possible_values(self.bitmask)
+        return self._geometry.mask_to_values[self.bitmask]
 
     def eliminate(self, other):
         """
@@ -118,9 +276,9 @@ class SudokuSquare:
         >>> s2
         sq#None 2
         """
-        if (self != other and
-                other.bitmask & self._value_bitmask > 0):
-            self._value_bitmask -= other.bitmask & self._value_bitmask
+        mask = self.bitmask
+        if self is not other and other.bitmask & mask > 0:
+            self.set_bitmask(mask & ~other.bitmask)
 
     def __isub__(self, other):
         self.eliminate(other)
@@ -134,88 +292,365 @@ class SudokuSquare:
             ''.join([str(v) for v in self.possible_values()]))
 
 
-class SudokuState:
+class SudokuState(object):
+    """A snapshot of the board's possible values.
+
+    The values live in a single packed buffer: one `array('H')` bitmask per
+    square plus a bytearray of givens, so copying a state is a couple of
+    memcpys rather than N_4 new SudokuSquares. `squares` hands out
+    SudokuSquare views onto that buffer on demand.
+
+    Every bitmask change goes through set_bitmask(), which keeps a Zobrist
+    hash of the masks up to date, so hashing is O(1) and comparing unequal
+    states almost always is too. As with any hashable that can be mutated,
+    don't change a state while it is a dict key.
+
+    >>> set_N(2)
+    >>> state = SudokuState(board=SudokuBoard())
+    >>> state.squares[5].set_value(3)
+    >>> child = state.copy()
+    >>> child.squares[5].set_value(2)
+    >>> state.squares[5], child.squares[5]
+    (sq#5 3, sq#5 2)
+    >>> state.bitmask(5), child.masks[5]
+    (4, 2)
+    >>> child == state, hash(child) == hash(state)
+    (False, False)
+    >>> child.set_bitmask(5, 4)
+    >>> child == state, hash(child) == hash(state)
+    (True, True)
+    >>> hash(child) == hash(SudokuState(masks=child.masks[:]))
+    True
+
+    Its size comes from its board, so states of any size can coexist:
+
+    >>> big = SudokuState(board=SudokuBoard(n=3))
+    >>> big.geometry.N_4, len(big.masks), big.squares[80]
+    (81, 81, sq#80 123456789)
+    >>> state.squares[0]
+    sq#0 1234
+
+    Setting `trail` to a list logs every change as (index, old bitmask), so
+    a search can work on one state and undo back to a mark:
+
+    >>> state.trail = []
+    >>> state.set_bitmask(0, 1)
+    >>> mark = len(state.trail)
+    >>> state.squares[1].set_value(2)
+    >>> state.trail
+    [(0, 15), (1, 15)]
+    >>> state.undo(mark)
+    >>> state.squares[0], state.squares[1], state.trail
+    (sq#0 1, sq#1 1234, [(0, 15)])
+
+    `digits` is the same information per value: digits[v] is an N_4-bit int
+    with bit i set where square i can still be v. It is built on first use
+    and then kept in step by set_bitmask, so "where can 2 go in unit 4" is
+    one and:
+
+    >>> state.trail = None
+    >>> bin(state.digits[1])
+    '0b1111111111011111'
+    >>> state.squares[4].set_value(3)
+    >>> bin(state.places(2, 4)), bin(state.copy().digits[3])
+    ('0b1000100000000', '0b1111111111111110')
+    """
     def __init__(self, squares=None, parent=None, transition_technique=None,
-                 board=None):
-        if not squares:
-            squares = [SudokuSquare(id=i) for i in range(N_4)]
-        self.squares = squares
+                 board=None, masks=None, givens=None, zobrist_hash=None,
+                 geometry=None, digits=None):
         self.parent = parent
         self.transition_technique = transition_technique
-
         self._id = 0
+        self.board = None
 
         if parent:
             self.board = parent.board
             self._id = parent._id + 1
+            geometry = geometry or parent.geometry
         elif board:
             self.board = board
+            geometry = geometry or board.geometry
+        elif squares:
+            geometry = geometry or squares[0].geometry
+        self.geometry = geometry = geometry or GEOMETRY
+
+        if masks is None:
+            if squares:
+                masks = array('H', [sq.bitmask for sq in squares])
+                givens = bytearray(
+                    [1 if sq.frozen else 0 for sq in squares])
+            else:
+                masks = array('H', [geometry.full_bitmask]) * geometry.N_4
+        if givens is None:
+            givens = bytearray(len(masks))
+        self._masks = masks
+        self._givens = givens
+        if zobrist_hash is None:
+            zobrist_hash = 0
+            for i, bm in enumerate(masks):
+                zobrist_hash ^= geometry.zobrist_key(i, bm)
+        self._hash = zobrist_hash
+        self._digits = digits
+        self._squares = None
+        self.trail = None
+
+    @classmethod
+    def from_string(cls, puzzle, board=None):
+        """Load a puzzle line: optional x/m flags, then N_4 of 1-9 or '.'
+
+        Without a board, one is built from the flags, sized by the line.
+
+        >>> state = SudokuState.from_string('x1' + '.' * 15)
+        >>> state.board.x_regions, state.geometry, state.squares[0]
+        (True, SudokuGeometry(2), sq#0 1)
+        >>> state.is_given(0), state.is_given(1)
+        (True, False)
+        >>> SudokuState.from_string('123')
+        Traceback (most recent call last):
+            ...
+        ValueError: Expected 16, 81 or 256 squares, got '123'
+        """
+        puzzle = puzzle.strip()
+        values = puzzle.lstrip('xm')
+        flags = puzzle[:len(puzzle) - len(values)]
+        if board is None:
+            n = int(round(len(values) ** 0.25))
+            if n not in SIZES or n ** 4 != len(values):
+                sizes = [str(size ** 4) for size in SIZES]
+                raise ValueError("Expected {} or {} squares, got {!r}".format(
+                    ', '.join(sizes[:-1]), sizes[-1], puzzle))
+            board = SudokuBoard('x' in flags, 'm' in flags, n=n)
+        geometry = board.geometry
+        if len(values) != geometry.N_4:
+            raise ValueError("Expected {} squares, got {!r}".format(
+                geometry.N_4, puzzle))
+        masks = array('H', [geometry.full_bitmask]) * geometry.N_4
+        givens = bytearray(geometry.N_4)
+        for i, ch in enumerate(values):
+            if ch not in '.0':
+                masks[i] = geometry.value_to_bitmask[int(ch)]
+                givens[i] = 1
+        return cls(board=board, masks=masks, givens=givens)
 
     @property
     def id(self):
         return self._id
 
+    @property
+    def squares(self):
+        if self._squares is None:
+            self._squares = [SudokuSquare.view(self, i)
+                             for i in range(len(self._masks))]
+        return self._squares
+
+    @property
+    def masks(self):
+        """The packed per-square bitmasks (read-only by convention)"""
+        return self._masks
+
+    @property
+    def digits(self):
+        """Per-value bitboards of the squares each value is possible in"""
+        if self._digits is None:
+            geometry = self.geometry
+            value_to_bitmask = geometry.value_to_bitmask
+            digits = [0] * (geometry.N_2 + 1)
+            for v in range(1, geometry.N_2 + 1):
+                bm = value_to_bitmask[v]
+                board = 0
+                for i, mask in enumerate(self._masks):
+                    if mask & bm:
+                        board |= 1 << i
+                digits[v] = board
+            self._digits = digits
+        return self._digits
+
+    def places(self, value, unit):
+        """Bitboard of the squares in board unit `unit` that can be value"""
+        return self.digits[value] & self.board.unit_masks[unit]
+
+    def bitmask(self, index):
+        return self._masks[index]
+
+    def set_bitmask(self, index, bitmask):
+        masks = self._masks
+        if self.trail is not None:
+            self.trail.append((index, masks[index]))
+        changed = masks[index] ^ bitmask
+        geometry = self.geometry
+        self._hash ^= (geometry.zobrist_lo[index][changed & 0xff] ^
+                       geometry.zobrist_hi[index][changed >> 8])
+        masks[index] = bitmask
+        if self._digits is not None:
+            digits = self._digits
+            bit = 1 << index
+            for v in geometry.mask_to_values[changed]:
+                digits[v] ^= bit
+
+    def undo(self, mark):
+        """Roll changes back until the trail is mark entries long"""
+        trail, self.trail = self.trail, None
+        while len(trail) > mark:
+            self.set_bitmask(*trail.pop())
+        self.trail = trail
+
+    def is_given(self, index):
+        return bool(self._givens[index])
+
     def copy(self, transition_technique=None):
-        squares = [SudokuSquare(bitmask=sq.bitmask, id=sq._id)
-                   for sq in self.squares]
+        digits = self._digits
         return SudokuState(
-            squares=squares, parent=self,
-            transition_technique=transition_technique)
+            masks=self._masks[:], givens=self._givens[:], parent=self,
+            transition_technique=transition_technique,
+            zobrist_hash=self._hash, geometry=self.geometry,
+            digits=digits[:] if digits is not None else None)
 
-    @classmethod
-    def square_index(cls, x, y):
-        return y * N_2 + x
+    def square_index(self, x, y):
+        return self.geometry.square_index(x, y)
 
     @property
     def sets(self):
         return self.board.sets(self)
 
+    @property
+    def units(self):
+        return self.board.units
+
     def __eq__(self, other):
-        if not other:
+        if not isinstance(other, SudokuState):
+            return False
+        if self._hash != other._hash:
             return False
-        for i, my_sq in enumerate(self.squares):
-            if my_sq.bitmask != other.squares[i].bitmask:
-                return False
-        return True
+        return self._masks == other._masks
 
-    def __neq__(self, other):
+    def __ne__(self, other):
         return not self == other
 
+    def __hash__(self):
+        return self._hash
+
     def __sub__(self, other):
         diff_state = self.copy()
-        for i, my_sq in enumerate(self.squares):
-            diff_state.squares[i].set_bitmask(
-                abs(my_sq.bitmask - other.squares[i].bitmask))
+        for i, my_mask in enumerate(self._masks):
+            diff_state.set_bitmask(i, abs(my_mask - other._masks[i]))
         return diff_state
 
     def __str__(self):
         return "st#{} {}".format(self._id, self.squares)
 
 
-class SudokuBoard:
-    def __init__(self):
+class SudokuBoard(object):
+    _compiled = {}
+
+    def __init__(self, x_regions=False, meta_regions=False, n=None):
+        """
+        >>> set_N(2)
+        >>> board = SudokuBoard(x_regions=True)
+        >>> len(board.units)
+        14
+        >>> board.units[-1]
+        (12, 9, 6, 3)
+        >>> [board.units[u] for u in board.cell_units[5]]
+        [(4, 5, 6, 7), (1, 5, 9, 13), (0, 1, 4, 5), (0, 5, 10, 15)]
+        >>> board.peers[5]
+        (0, 1, 4, 6, 7, 9, 10, 13, 15)
+        >>> SudokuBoard(n=3).geometry, len(SudokuBoard(n=3).units)
+        (SudokuGeometry(3), 27)
+        >>> board.units is SudokuBoard(x_regions=True).units
+        True
+        >>> board.unit_constraints[4].__name__, bin(board.unit_masks[4])
+        ('ColumnConstraint', '0b1000100010001')
+        >>> board.peer_masks[0] == sum(1 << j for j in board.peers[0])
+        True
+        >>> board.intersections[0]
+        (0, 8, 3)
+        """
+        self.geometry = SudokuGeometry.for_size(n) if n else GEOMETRY
+        self.x_regions = x_regions
+        self.meta_regions = meta_regions
         self.constraints = [
             RowConstraint,
             ColumnConstraint,
             SectorConstraint
         ]
+        if x_regions:
+            self.constraints.append(XConstraint)
+        if meta_regions:
+            self.constraints.append(MetaConstraint)
+        self._compile()
+
+    def _compile(self):
+        """Flatten the active constraints into immutable index tables:
+
+            units: a tuple of square index tuples, one per group
+            unit_constraints: the constraint class each unit came from
+            cell_units: for each square, the indexes of units containing it
+            peers: for each square, the other squares sharing a unit with it
+
+        and their bitboard forms, with bit i standing for square i:
+
+            unit_masks: for each unit, its squares
+            peer_masks: for each square, its peers
+            intersections: (a, b, mask of shared squares) for every ordered
+                pair of units sharing more than one square
+
+        Tables are shared by every board with the same size and constraints.
+        """
+        key = (self.geometry.N, tuple(self.constraints))
+        if key not in SudokuBoard._compiled:
+            groups = [(constraint, tuple(group))
+                      for constraint in self.constraints
+                      for group in constraint.group_indices(self.geometry)]
+            units = tuple(group for constraint, group in groups)
+            unit_constraints = tuple(
+                constraint for constraint, group in groups)
+
+            cell_units = [[] for i in range(self.geometry.N_4)]
+            for u, unit in enumerate(units):
+                for i in unit:
+                    cell_units[i].append(u)
+            cell_units = tuple(tuple(us) for us in cell_units)
+
+            peers = tuple(
+                tuple(sorted(set(j for u in us for j in units[u]) - {i}))
+                for i, us in enumerate(cell_units))
+
+            unit_masks = tuple(
+                sum(1 << i for i in unit) for unit in units)
+            peer_masks = tuple(sum(1 << j for j in ps) for ps in peers)
+            intersections = tuple(
+                (a, b, unit_masks[a] & unit_masks[b])
+                for a in range(len(units)) for b in range(len(units))
+                if a != b and len(set(units[a]) & set(units[b])) > 1)
+            SudokuBoard._compiled[key] = (
+                units, unit_constraints, cell_units, peers,
+                unit_masks, peer_masks, intersections)
+        (self.units, self.unit_constraints, self.cell_units, self.peers,
+         self.unit_masks, self.peer_masks,
+         self.intersections) = SudokuBoard._compiled[key]
 
     def sets(self, state):
-        for constraint in self.constraints:
-            for sq_set in constraint.groups_iter(state):
-                yield set(sq_set)
+        squares = state.squares
+        for unit in self.units:
+            yield [squares[i] for i in unit]
 
 
 class SudokuBoardConstraint:
     @classmethod
     def groups_iter(cls, state):
         """Return a list of iterables of SudokuSquares"""
-        return
+        for group in cls.group_indices(state.geometry):
+            yield [state.squares[i] for i in group]
+
+    @classmethod
+    def group_indices(cls, geometry):
+        """Return a list of iterables of square indexes"""
+        return []
 
 
 class XConstraint(SudokuBoardConstraint):
     @classmethod
-    def groups_iter(cls, state):
+    def group_indices(cls, geometry):
         """
         >>> set_N(2)
         >>> global N, N_2, N_3, N_4
@@ -260,19 +695,19 @@ class XConstraint(SudokuBoardConstraint):
         >>> range((N_2 - 1) * N_2, N_2 - 2, 1 - N_2)
         [12, 9, 6, 3]
         """
-        yield [state.squares[i] for i in range(0, N_4, N_2 + 1)]
+        N_2, N_4 = geometry.N_2, geometry.N_4
+        yield range(0, N_4, N_2 + 1)
 
         # 0 => 12
         # 1 => 9
         # 2 => 6
         # 3 => 3
-        yield [state.squares[i] for i in
-               range((N_2 - 1) * N_2, N_2 - 2, 1 - N_2)]
+        yield range((N_2 - 1) * N_2, N_2 - 2, 1 - N_2)
 
 
 class MetaConstraint(SudokuBoardConstraint):
     @classmethod
-    def groups_iter(cls, state):
+    def group_indices(cls, geometry):
         """
         >>> set_N(2)
         >>> global N, N_2, N_3, N_4
@@ -305,9 +740,9 @@ class MetaConstraint(SudokuBoardConstraint):
         """
         # N = 2 -> yield 1 set
         # N = 3 -> yield 4 sets
-        if N == 2:
-            yield [state.squares[i] for i in [5, 6, 9, 10]]
-        elif N == 3:
+        if geometry.N == 2:
+            yield [5, 6, 9, 10]
+        elif geometry.N == 3:
             yield [10, 11, 12, 19, 20, 21, 28, 29, 30]
             yield [14, 15, 16, 23, 24, 25, 32, 33, 34]
             yield [46, 47, 48, 55, 56, 57, 64, 65, 66]
@@ -316,7 +751,7 @@ class MetaConstraint(SudokuBoardConstraint):
 
 class RowConstraint(SudokuBoardConstraint):
     @classmethod
-    def groups_iter(cls, state):
+    def group_indices(cls, geometry):
         """
         >>> set_N(2)
         >>> board = SudokuBoard()
@@ -356,15 +791,14 @@ class RowConstraint(SudokuBoardConstraint):
         #====+====#====+====#
         [None, None, None, None]
         """
-        for i in range(N_2):
-            yield state.squares[
-                SudokuState.square_index(0, i):
-                SudokuState.square_index(0, i+1)]
+        for i in range(geometry.N_2):
+            yield range(geometry.square_index(0, i),
+                        geometry.square_index(0, i+1))
 
 
 class ColumnConstraint(SudokuBoardConstraint):
     @classmethod
-    def groups_iter(cls, state):
+    def group_indices(cls, geometry):
         """
         >>> set_N(2)
         >>> board = SudokuBoard()
@@ -404,13 +838,13 @@ class ColumnConstraint(SudokuBoardConstraint):
         #====+====#====+====#
         [None, None, None, None]
         """
-        for i in range(N_2):
-            yield [state.squares[j] for j in range(N_4) if j % N_2 == i]
+        for i in range(geometry.N_2):
+            yield range(i, geometry.N_4, geometry.N_2)
 
 
 class SectorConstraint(SudokuBoardConstraint):
     @classmethod
-    def groups_iter(cls, state):
+    def group_indices(cls, geometry):
         """
         >>> set_N(2)
         >>> board = SudokuBoard()
@@ -450,17 +884,17 @@ class SectorConstraint(SudokuBoardConstraint):
         #====+====#====+====#
         [None, None, None, None]
         """
-        for i in range(N_2):
+        N = geometry.N
+        for i in range(geometry.N_2):
             start_y = i / N * N
             start_x = i % N * N
 
-            squares = []
+            indices = []
             for y in range(start_y, start_y + N):
-                squares += state.squares[
-                    SudokuState.square_index(start_x, y):
-                    SudokuState.square_index(start_x, y) + N]
+                indices += range(geometry.square_index(start_x, y),
+                                 geometry.square_index(start_x, y) + N)
 
-            yield squares
+            yield indices
 
 
 ROW_LETTERS = 'ABCDEFGHI'
@@ -468,11 +902,13 @@ ROW_LETTERS = 'ABCDEFGHI'
 
 class StatePrinter:
     @classmethod
-    def line_sep(cls):
+    def line_sep(cls, geometry=None):
+        N = (geometry or GEOMETRY).N
         return ('#' + '+'.join(['-' * (2 + N)] * N)) * N + '#'
 
     @classmethod
-    def major_line_sep(cls):
+    def major_line_sep(cls, geometry=None):
+        N = (geometry or GEOMETRY).N
         return ('#' + '+'.join(['=' * (2 + N)] * N)) * N + '#'
 
     @classmethod
@@ -497,17 +933,20 @@ class StatePrinter:
         # 34 | 34 # 34 |    #
         #====+====#====+====#
         """
-        print cls.major_line_sep()
+        geometry = state.geometry
+        print cls.major_line_sep(geometry)
         for rowno, line in enumerate(StatePrinter._get_board_lines(
                 state, color=color)):
             print line
-            if (rowno + 1) % N == 0:
-                print cls.major_line_sep()
+            if (rowno + 1) % geometry.N == 0:
+                print cls.major_line_sep(geometry)
             else:
-                print cls.line_sep()
+                print cls.line_sep(geometry)
 
     @classmethod
     def print_board_diff(cls, state1, state2, color=False):
+        geometry = state1.geometry
+        N = geometry.N
         diff_state = state2 - state1
         state1_lines = '\n'.join(
             StatePrinter._get_board_lines(state1, color=color)).split('\n')
@@ -517,7 +956,8 @@ class StatePrinter:
             StatePrinter._get_board_lines(
                 diff_state, prefix='-', color=color)).split('\n')
 
-        sys.stdout.write(' -> '.join([cls.major_line_sep() for i in range(3)]))
+        sys.stdout.write(' -> '.join(
+            [cls.major_line_sep(geometry) for i in range(3)]))
         sys.stdout.write('\n')
 
         for rowno, line in enumerate(state1_lines):
@@ -525,9 +965,9 @@ class StatePrinter:
                 [line, diff_state_lines[rowno], state2_lines[rowno]]))
             sys.stdout.write('\n')
             if (rowno + 1) % N == 0 and (rowno / N + 1) % N == 0:
-                sep = cls.major_line_sep()
+                sep = cls.major_line_sep(geometry)
             elif (rowno + 1) % N == 0:
-                sep = cls.line_sep()
+                sep = cls.line_sep(geometry)
             else:
                 sep = None
 
@@ -544,22 +984,24 @@ class StatePrinter:
         >>> list(StatePrinter._get_board_lines(SudokuState(squares=squares, board=board)))  # noqa
         ['#    | 1  #  2 | 12 #\n#    |    #    |    #', '#    | 1  #  2 | 12 #\n# 3  | 3  # 3  | 3  #', '#    | 1  #  2 | 12 #\n#  4 |  4 #  4 |  4 #', '#    | 1  #  2 |    #\n# 34 | 34 # 34 |    #']
         """
-        for y in range(N_2):
+        for y in range(state.geometry.N_2):
             for row in cls._get_row_lines(
-                    state.squares[SudokuState.square_index(0, y):
-                                  SudokuState.square_index(0, y + 1)],
+                    state.squares[state.square_index(0, y):
+                                  state.square_index(0, y + 1)],
                     prefix=prefix, color=color):
                 yield row
 
     @classmethod
     def print_square_set(cls, squares):
-        print cls.major_line_sep()
+        geometry = squares[0].geometry
+        print cls.major_line_sep(geometry)
         for line in cls._get_row_lines(squares, major_sep='|'):
             print line
-        print cls.major_line_sep()
+        print cls.major_line_sep(geometry)
 
     @classmethod
     def _get_row_lines(cls, squares, major_sep='#', prefix=' ', color=False):
+        N = squares[0].geometry.N
         row_lines = [''] * N
         for x, sq in enumerate(squares):
             for lino, sqline in enumerate(cls._state_lines(sq, color=color)):
@@ -583,15 +1025,17 @@ class StatePrinter:
         >>> ','.join(StatePrinter._state_lines(square))
         '  ,  '
         """
-        if sq.bitmask == SudokuSquare.full_bitmask():
-            return [' ' * N] * N
+        geometry = sq.geometry
+        if sq.bitmask == geometry.full_bitmask:
+            return [' ' * geometry.N] * geometry.N
         return tuple(cls._state_line_iter(sq, color=color))
 
     @classmethod
     def _state_line_iter(cls, sq, color=False):
+        N = sq.geometry.N
         for lino in range(N):
             vals = [str(i)
-                    if sq & i == SudokuSquare.value_to_bitmask(i) else ' '
+                    if sq & i == sq.geometry.value_to_bitmask[i] else ' '
                     for i in range(1 + N * lino, 1 + N * lino + N)
                     ]
             yield "".join(cls._color_vals(sq, vals, color))
@@ -679,7 +1123,13 @@ class StatePrinter:
             r'^[xm]?[.1-9]{81}([.1-9]{81}(([0-9]{3}|.[1-9]g){81})?)?'
             are ignored, so whitespace/formatting does not matter.
         """
-        return ''.join([str(sq.known_value or '.') for sq in state.squares])
+        prefix = ''
+        if state.board and state.board.x_regions:
+            prefix += 'x'
+        if state.board and state.board.meta_regions:
+            prefix += 'm'
+        return prefix + ''.join(
+            [str(sq.known_value or '.') for sq in state.squares])
         # * 2
         #              + ["{:03d}".format(sq.bitmask) for sq in state.squares])
 
@@ -0,0 +1,114 @@
+import json
+import sys
+from collections import namedtuple, OrderedDict
+
+DEBUG = 10
+INFO = 20
+OFF = 100
+
+
+class Guess(namedtuple('Guess', 'square value depth')):
+    """GuessAndCheck set square to value, depth guesses deep"""
+    __slots__ = ()
+    name = 'guess'
+    level = DEBUG
+
+
+class Revert(namedtuple('Revert', 'square value depth')):
+    """GuessAndCheck undid a guess that led to a contradiction"""
+    __slots__ = ()
+    name = 'revert'
+    level = DEBUG
+
+
+class Eliminate(namedtuple('Eliminate', 'technique squares candidates')):
+    """A technique removed candidates from some squares"""
+    __slots__ = ()
+    name = 'eliminate'
+    level = DEBUG
+
+
+class Dissolve(namedtuple('Dissolve', 'square value removed')):
+    """The generator tried to remove a given; removed says if it could"""
+    __slots__ = ()
+    name = 'dissolve'
+    level = INFO
+
+
+class TraceSink(object):
+    """Receives trace events at or above its level; this one drops them all.
+
+    Call sites check the level before building an event, so a disabled sink
+    costs one attribute comparison:
+
+        if sink.level <= Guess.level:
+            sink.emit(Guess(square, value, depth))
+    """
+    level = OFF
+
+    def emit(self, event):
+        pass
+
+
+class PrintSink(TraceSink):
+    """Write events as readable lines
+
+    >>> sink = PrintSink(DEBUG)
+    >>> sink.emit(Guess(square=3, value=4, depth=1))
+    guess square=3 value=4 depth=1
+    """
+    def __init__(self, level=INFO, out=None):
+        self.level = level
+        self.out = out
+
+    def emit(self, event):
+        out = self.out or sys.stdout
+        out.write('{} {}\n'.format(event.name, ' '.join(
+            '{}={}'.format(k, v) for k, v in zip(event._fields, event))))
+
+
+class JsonLinesSink(TraceSink):
+    """Write events as compact JSON objects, one per line
+
+    out is a file object or a path to append to.
+
+    >>> from StringIO import StringIO
+    >>> out = StringIO()
+    >>> sink = JsonLinesSink(out)
+    >>> sink.emit(Dissolve(square=40, value=7, removed=True))
+    >>> out.getvalue()
+    '{"event":"dissolve","square":40,"value":7,"removed":true}\\n'
+    """
+    def __init__(self, out, level=DEBUG):
+        self.level = level
+        if isinstance(out, basestring):
+            out = open(out, 'a')
+        self.out = out
+
+    def emit(self, event):
+        record = OrderedDict([('event', event.name)])
+        record.update(zip(event._fields, event))
+        self.out.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def close(self):
+        self.out.close()
+
+
+sink = TraceSink()
+
+
+def set_sink(new_sink):
+    """Route events to new_sink (None to disable); return the old sink
+
+    >>> import sudoku_trace
+    >>> old = set_sink(PrintSink())
+    >>> sudoku_trace.sink.level
+    20
+    >>> set_sink(old).level
+    20
+    >>> sudoku_trace.sink.level == OFF
+    True
+    """
+    global sink
+    old, sink = sink, new_sink or TraceSink()
+    return old
@@ -1,6 +1,14 @@
+from array import array
+from itertools import izip
 from random import shuffle
+import re
+import string
 import time
 from solvable import Square, ExclusiveSet, N, N_2, N_4, UnsolvableError, ROW_LETTERS
+from solvable import ChangeCounter, ALL_VALUES, MASK_VALUES, POPCOUNT
+from solvable import propagate
+from sudoku2.sudoku_state import SudokuState
+from sudoku2.sudoku_solver import count_solutions
 
 MIN_CLUES = 19
 MAX_CLUES = 24
@@ -8,11 +16,24 @@ MAX_CLUES = 24
 # TODO: allow increased/decreased verbosity?
 YIELD_ITERS = 500
 
+# load_game keeps digits and dots, reading 'g' as a dot
+PURGE_CHARS = ''.join(
+    chr(i) for i in range(256) if chr(i) not in '0123456789.g')
+G_TO_DOT = string.maketrans('g', '.')
+# a bare puzzle needs no purging
+PLAIN_LINE = re.compile(r'[xm]*[.0-9]{%d}\Z' % N_4)
+# characters for current_state
+VALUE_CHARS = '.' + ''.join(str(v) for v in range(1, N_2 + 1))
+MASK_CHARS = ['{:03d}'.format(mask) for mask in range(ALL_VALUES + 1)]
+
 
 class SudokuBoard(object):
     def __init__(self, x_regions=False, meta_regions=False):
         self.start_time = time.clock()
-        self.grid = [[Square(x, y) for x in range(N_2)] for y in range(N_2)]
+        self.changes = ChangeCounter()
+        self.grid = [[Square(x, y, self.changes) for x in range(N_2)]
+                     for y in range(N_2)]
+        self.squares = [sq for row in self.grid for sq in row]
         self.sets = set()
         self._log = []
         self.cursor_x = 0
@@ -22,6 +43,8 @@ class SudokuBoard(object):
         self.meta_regions = meta_regions
         self.original_state = None
         self.clues = 0
+        # (set, square) pairs handled by propagate() while solving
+        self.propagations = 0
         self.saved_states = []
         self.redo_states = []
         self.build_rows()
@@ -49,28 +72,31 @@ class SudokuBoard(object):
 
             All characters not in
             r'^[xm]?[.1-9]{81}([.1-9]{81}(([0-9]{3}|.[1-9]g){81})?)?'
-            are ignored, so whitespace/formatting does not matter.
+            are ignored, so whitespace/formatting does not matter. A 0
+            in the first two parts counts as a '.'.
+
+            >>> board = SudokuBoard()
+            >>> board.load_game('x 12 | ' + '0' * 79)
+            >>> board.x_regions, board.clues, board.grid[0][1]
+            (True, 2, A1: ==2)
         """
-        if not line:
-            line = '.' * N_4
+        line = str(line or '.' * N_4)
 
         if not self.original_state:
             self.original_state = line
         if 'x' in line:
             self.set_x_regions(True)
-            # line = line.translate(None, 'x')
         else:
             self.set_x_regions(False)
         if 'm' in line:
             self.set_meta_regions(True)
-            # line = line.translate(None, 'm')
         else:
             self.set_meta_regions(False)
-        # purge irrelevant characters
-        line = line.replace('g', '.').replace('|', '')
-        for i, ch in enumerate(line):
-            if ch not in '123456789.':
-                line = line[:i] + line[i+1:]
+        if PLAIN_LINE.match(line):
+            line = line[-N_4:]
+        else:
+            # purge irrelevant characters
+            line = line.translate(G_TO_DOT, PURGE_CHARS)
 
         if len(line) not in (N_4, 2 * N_4, 5 * N_4):
             self.log("Invalid line: {} ({} ch)".format(line, len(line)))
@@ -79,70 +105,79 @@ class SudokuBoard(object):
                 "must be one of length {} (yours was {})".format(
                     (N_4, 2 * N_4, 5 * N_4), len(line)))
 
+        givens = line[:N_4]
+        values = line[N_4:2 * N_4]
+        masks = line[2 * N_4:]
         self.clues = 0
-        for y in range(N_2):
-            for x in range(N_2):
-                char = line[y * N_2 + x]
-                sq = self.grid[y][x]
-                if char != ".":
-                    val = int(char)
-                    sq.set_value(val, given=True)
-                    self.clues += 1
-                elif len(line) >= 2 * N_4 and line[N_4 + y * N_2 + x] != '.':
-                    val = int(line[N_4 + y * N_2 + x])
-                    self.grid[y][x].set_value(val, given=False)
-                elif len(line) >= 5 * N_4:
-                    mask_start = 2 * N_4 + 3 * (y * N_2 + x)
-                    mask_str = line[mask_start:mask_start+3]
-                    if mask_str == '...':
-                        continue
-                    value_mask = int(mask_str)
-                    values = set()
-                    for i in range(N_2):
-                        if 2**i & value_mask == 2**i:
-                            values.add(i + 1)
-                    sq.set_possible_values(values)
-                else:
-                    self.grid[y][x].clear()
-                self.grid[y][x].reset_values_to_attempt()
+        for i, sq in enumerate(self.squares):
+            char = givens[i]
+            if char not in '.0':
+                sq.set_value(int(char), given=True)
+                self.clues += 1
+                sq.reset_values_to_attempt()
+                continue
+            sq.is_given = False
+            if values and values[i] not in '.0':
+                sq.set_value(int(values[i]))
+            elif masks and masks[3 * i:3 * i + 3] != '...':
+                sq.set_mask(int(masks[3 * i:3 * i + 3]))
+            else:
+                sq.clear()
+            sq.reset_values_to_attempt()
 
     def current_state(self, givens_only=False, include_possibles=True):
         # return the state of the board as would be loaded
-        line = ''
-        line += 'x' if self.x_regions else ''
-        line += 'm' if self.meta_regions else ''
-        line2 = ''
-        line3 = ''
-        for y in range(N_2):
-            for x in range(N_2):
-                sq = self.grid[y][x]
-                if sq.get_value():
-                    if sq.is_given:
-                        line += str(sq.get_value())
-                    else:
-                        line += '.'
-                    line2 += str(sq.get_value())
-                else:
-                    line += '.'
-                    line2 += '.'
-                if sq.is_unknown():
-                    line3 += '...'
-                elif sq.get_value():
-                    line3 += '.' + str(sq.get_value()) + (
-                        'g' if sq.is_given else '.')
-                else:
-                    line3 += '{:03d}'.format(self._possible_value_mask(sq))
+        flags = ('x' if self.x_regions else '') + (
+            'm' if self.meta_regions else '')
+        line = flags + ''.join([
+            VALUE_CHARS[sq.get_value() or 0] if sq.is_given else '.'
+            for sq in self.squares])
         if givens_only:
             return line
+        line2 = ''.join([VALUE_CHARS[sq.get_value() or 0]
+                         for sq in self.squares])
         if not include_possibles:
             return "{}|{}".format(line, line2)
+        line3 = ''.join([self._state_chars(sq) for sq in self.squares])
         return "{}|{}|{}".format(line, line2, line3)
 
+    def _state_chars(self, sq):
+        value = sq.get_value()
+        if value:
+            return ('.{}g' if sq.is_given else '.{}.').format(value)
+        if sq.is_unknown():
+            return '...'
+        return MASK_CHARS[self._possible_value_mask(sq)]
+
     def _possible_value_mask(self, sq):
-        mask = 0
-        for i in sq.possible_values:
-            mask += 2**(i - 1)
-        return mask
+        return sq.mask
+
+    @property
+    def version(self):
+        """Goes up whenever any square's value or candidates change"""
+        return self.changes.count
+
+    def snapshot(self):
+        """The squares' states as a compact array, for restore()
+
+        Unlike current_state() this skips formatting, and restore() skips
+        parsing, so it suits undoing guesses while solving.
+
+        >>> board = SudokuBoard()
+        >>> board.load_game('12' + '.' * 79)
+        >>> saved, version = board.snapshot(), board.version
+        >>> board.grid[0][2].set_value(3)
+        >>> board.version > version
+        True
+        >>> board.restore(saved)
+        >>> board.grid[0][1], board.grid[0][2]
+        (A1: ==2, A2:  ??123456789)
+        """
+        return array('H', [sq.snapshot() for sq in self.squares])
+
+    def restore(self, snapshot):
+        for sq, state in izip(self.squares, snapshot):
+            sq.restore(state)
 
     def unsolved_squares(self):
         for row in self.grid:
@@ -269,40 +304,44 @@ class SudokuBoardSolver(SudokuBoard):
                 break
         if self.is_solved():
             return
-        inferred_state = self.current_state()
+        inferred = self.snapshot()
 
         yield ("lev {}: No more progress from solve_step: " +
-               inferred_state).format(level)
-
-        for sq in set(self.unsolved_squares()):
-            if sq.get_value():
-                continue
-            pv = list(sq.possible_values)
-            pv_orig = pv[:]
-            for i, v in enumerate(pv_orig):
-                self.load_game(inferred_state)
-                sq.set_value(v, False)
-                yield ("lev {}: Guess and checking with {} ({}/{})".format(
-                    level, sq, i+1, len(pv_orig)))
-                try:
-                    for msg in self._solve_iter(level + 1, verbose=verbose):
-                        yield msg
-                    if self.is_solved():
-                        return
-                except UnsolvableError as ue:
-                    yield str(ue)
-                    pv.remove(v)
-                    # if not any(pv):
-                    #     raise ue
-            self.load_game(inferred_state)
-
-            if pv and pv != pv_orig:
-                sq.set_possible_values(set(pv))
-                inferred_state = self.current_state()
+               self.current_state()).format(level)
+
+        for sq in self.squares:
+            if sq.get_value() and sq.has_conflict():
+                raise UnsolvableError("{} conflicts".format(sq))
+        unsolved = list(self.unsolved_squares())
+        if not unsolved:
+            raise UnsolvableError("Every square is filled, but not solved")
+        # guess at the square with the fewest candidates left
+        sq = min(unsolved, key=lambda sq: len(sq.possible_values))
+        pv = list(sq.possible_values)
+        for i, v in enumerate(pv):
+            self.restore(inferred)
+            sq.set_value(v, False)
+            yield ("lev {}: Guess and checking with {} ({}/{})".format(
+                level, sq, i+1, len(pv)))
+            try:
+                for msg in self._solve_iter(level + 1, verbose=verbose):
+                    yield msg
+                if self.is_solved():
+                    return
+            except UnsolvableError as ue:
+                yield str(ue)
+        self.restore(inferred)
+        # sq has to be one of pv, so a guess further up was wrong
+        raise UnsolvableError("No value for {} works".format(sq))
 
     def solve_iter(self, verbose=False):
-        for msg in self._solve_iter(verbose=verbose):
-            yield msg
+        self.propagations = 0
+        try:
+            for msg in self._solve_iter(verbose=verbose):
+                yield msg
+        except UnsolvableError as ue:
+            yield str(ue)
+        yield "{} propagations".format(self.propagations)
         if self.is_solved():
             state = self.current_state(include_possibles=False)
             yield "Solved! " + state
@@ -312,20 +351,20 @@ class SudokuBoardSolver(SudokuBoard):
 
     def solve_step(self, verbose=False):
         """return truthy if progress was made"""
-        prev_state = self.current_state()
-        # self.log("infer_values...")
-        for msg in self.solve_step_iter(prev_state, verbose=verbose):
-            if verbose:
+        prev_version = self.version
+        if verbose:
+            for msg in self.solve_step_iter(prev_version, verbose=verbose):
                 self.log(msg)
+        else:
+            self.propagations += propagate(self.unsolved_squares())
+        return self.version != prev_version
 
-        return self.current_state() != prev_state
-
-    def solve_step_iter(self, prev_state, verbose=False):
+    def solve_step_iter(self, prev_version, verbose=False):
         for sq in self.unsolved_squares():
             sq.infer_values()
         if verbose:
             yield "Infer values complete"
-        if self.current_state() != prev_state:
+        if self.version != prev_version:
             return
         for s in self.sets:
             for msg in s.try_solve_iter(verbose=verbose):
@@ -336,63 +375,97 @@ class SudokuBoardSolver(SudokuBoard):
             yield "try_solve complete"
 
     def bruteforce_iter(self):
-        start_square = self.selected_square
-        while start_square.is_given:
-            self.select_prev_square()
-            start_square = self.grid[self.cursor_y][self.cursor_x]
-        start_square.clear()
-        start_square.reset_values_to_attempt()
-        square = start_square
-
-        def status(start_square, square):
-            start_i = N_2 * start_square.y + start_square.x
-            current_i = N_2 * square.y + square.x
-            # I have no idea how I came up with this as the percent complete,
-            # but it gives satisfyingish numbers to give you hope as it
-            # crunches the solution
+        """Fill in the board by depth-first search
+
+        Each step fills the empty square with the fewest values left that
+        don't conflict with its peers, and backs up when a square runs out
+        of values. Values already on the board (other than givens) are
+        kept as guesses, so they can be backed into and changed too.
+
+        >>> board = SudokuBoardSolver()
+        >>> board.load_game('.94...13..............76..2.8..1.....32..'
+        ...                 '.......2...6.....5.4.......8..7..63.4..8')
+        >>> for msg in board.bruteforce_iter():
+        ...     pass
+        >>> board.is_solved()
+        True
+        """
+        # guessed squares, latest last; each has value_attempts left to try
+        trail = []
+        for sq in self.squares:
+            if sq.get_value() and not sq.is_given:
+                sq.reset_values_to_attempt()
+                if sq.get_value() in sq.value_attempts:
+                    sq.value_attempts.remove(sq.get_value())
+                trail.append(sq)
+
+        def status(square):
+            first = trail[0] if trail else square
+            # roughly: how far through the first guess's values, plus how
+            # deep the current guess is
             pct_complete = (
-                (N_2 - len(start_square.value_attempts)) * 100.0 / N_2 +
-                ((current_i - start_i) % N_4) * 100.0 / N_4 / N_2)
+                (N_2 - len(first.value_attempts) - 1) * 100.0 / N_2 +
+                len(trail) * 100.0 / N_4 / N_2)
 
             return "bf(~{:.2f}%) {} {} at {}".format(
-                pct_complete,
+                max(pct_complete, 0),
                 '>' if self.go_forward else '<',
-                start_square,
+                first,
                 square)
 
-        yield status(start_square, square)
+        square = self.selected_square
+        yield status(square)
+        if any(sq.is_given and sq.has_conflict() for sq in self.squares):
+            # no amount of guessing will fix that
+            return
+        self.go_forward = True
         i = 0
-        while (not self.is_solved() and
-               any(start_square.value_attempts)):
-            yield status(start_square, square)
-            if not square.is_given:
-                if not square.get_value():
-                    square.clear()
-                    square.reset_values_to_attempt()
-                    square.set_value(square.value_attempts.pop())
-                    self.go_forward = True
-                if not self.go_forward:
-                    if any(square.value_attempts):
-                        square.set_value(square.value_attempts.pop())
-                        self.go_forward = True
-                while self.go_forward and any(square.conflict_squares()):
-                    if not any(square.value_attempts):
-                        self.go_forward = False
-                    else:
-                        square.set_value(square.value_attempts.pop())
-
+        while not self.is_solved():
             if self.go_forward:
-                self.select_next_square()
+                square, free = self._most_constrained_square()
+                if square is None:
+                    # filled in, but with conflicts
+                    self.go_forward = False
+                    continue
+                square.value_attempts = list(MASK_VALUES[free])
+                trail.append(square)
+            elif trail:
+                square = trail[-1]
             else:
-                if square != start_square:
-                    square.clear()
-                    self.select_prev_square()
+                # every guess has been tried
+                break
+            self.cursor_x = square.x
+            self.cursor_y = square.y
+
+            self.go_forward = False
+            while square.value_attempts:
+                square.set_value(square.value_attempts.pop())
+                if not square.has_conflict():
+                    self.go_forward = True
+                    break
+            if not self.go_forward:
+                square.clear()
+                trail.pop()
+
             i += 1
             if i % YIELD_ITERS == 0:
-                yield status(start_square, square)
+                yield status(square)
 
-            square = self.grid[self.cursor_y][self.cursor_x]
-        # self.log(status(start_square, square), replace=True)
+    def _most_constrained_square(self):
+        """The empty square with the fewest free values, and those values
+
+        Returns (None, 0) if no square is empty.
+        """
+        best, best_free, fewest = None, 0, N_2 + 1
+        for sq in self.squares:
+            if sq.get_value():
+                continue
+            free = sq.free_mask()
+            if POPCOUNT[free] < fewest:
+                best, best_free, fewest = sq, free, POPCOUNT[free]
+                if fewest <= 1:
+                    break
+        return best, best_free
 
 
 class SudokuBoardGenerator(SudokuBoardSolver):
@@ -414,7 +487,7 @@ class SudokuBoardGenerator(SudokuBoardSolver):
                     ('m' if self.meta_regions else '') +
                     ''.join(givens))
 
-        givens = list(solution.translate(None, 'xm'))
+        givens = list(solution.translate(None, 'xm|'))
         givens = ['.'] * N_4 + givens[81:]
         all_squares = reduce(lambda l, row: l + row, self.grid, [])
         shuffle(all_squares)
@@ -433,27 +506,22 @@ class SudokuBoardGenerator(SudokuBoardSolver):
             if not any(all_squares) or (
                     len(all_squares) + len(given_squares) <= MIN_CLUES):
                 self.log("gen: as: {!r} gs: {!r}".format(all_squares, given_squares))
+                # sq is still in the puzzle, so it must end up a given
+                all_squares.append(sq)
                 break
             self.cursor_x = sq.x
             self.cursor_y = sq.y
             sq_val = sq.get_value()
-            sq.prevent_value(sq_val)
-            msg = 'gen: [{} togo / {} clues] trying with {} != {}'.format(
-                len(all_squares), len(given_squares), str(sq), sq_val)
+            msg = 'gen: [{} togo / {} clues] trying without {}'.format(
+                len(all_squares), len(given_squares), str(sq))
             self.log(msg)
+            yield msg
             givens[sq.id] = '.'
             givens[N_4 + sq.id] = '.'
-            self.log("gen: loading " + given_str(givens[81:]))
-            self.load_game(given_str(givens[81:]))
-            try:
-                for msg in self.solve_iter():
-                    yield msg
-            except UnsolvableError as ue:
-                yield str(ue)
-            sq.prevent_value(None)
-            if self.is_solved() and self.current_state(include_possibles=False) != solution:
-                # can't remove this square, since it's unsolvable
-                # or solvable another way without it
+            puzzle = SudokuState.from_string(given_str(givens[81:]))
+            if count_solutions(puzzle, limit=2) > 1:
+                # can't remove this square, since the puzzle is solvable
+                # another way without it
                 given_squares.add(sq)
                 msg = "gen: keeping {} ({} clues)".format(
                     sq, len(given_squares))
@@ -467,7 +535,7 @@ class SudokuBoardGenerator(SudokuBoardSolver):
                 sq.is_given = False
                 sq.clear()
                 sq.reset_values_to_attempt()
-                msg = "gen: unsolvable unless {}={}, removing".format(sq, sq_val)
+                msg = "gen: unique without {}={}, removing".format(sq, sq_val)
                 self.log(msg)
             self.log("gen: loading " + given_str(givens))
             self.load_game(given_str(givens))
@@ -0,0 +1,42 @@
+from click.testing import CliRunner
+
+from sudoku.sudoku import cli
+
+TOP95_1 = ('4.....8.5.3..........7......2.....6.....8.4......1......'
+           '.6.3.7.5..2.....1.4......')
+SOLUTION = ('417369825632158947958724316825437169791586432346912758'
+            '289643571573291684164875293')
+
+
+def spaced(line):
+    return ' '.join(line[i:i + 9] for i in range(0, len(line), 9))
+
+
+def test_profile_spaced_puzzle():
+    result = CliRunner().invoke(cli, ['solve', '--profile', spaced(TOP95_1)])
+    assert result.exit_code == 0, result.output
+    assert 'Solved! ' + SOLUTION in result.output
+    assert 'PropagateConstraints' in result.output
+
+
+def test_profile_saved_state():
+    state = '{}|{}'.format(TOP95_1, SOLUTION)
+    result = CliRunner().invoke(cli, ['solve', '-p', state])
+    assert result.exit_code == 0, result.output
+    assert 'Solved! ' + SOLUTION in result.output
+
+
+def test_profile_bad_puzzle():
+    result = CliRunner().invoke(cli, ['solve', '-p', '4.....8.5 .3'])
+    assert result.exit_code == 2
+    assert 'Invalid value for PUZZLE' in result.output
+
+
+def test_generate_trace_restores_sink(tmpdir):
+    from sudoku.sudoku2 import sudoku_trace
+    trace = tmpdir.join('trace.jsonl')
+    sink = sudoku_trace.sink
+    result = CliRunner().invoke(cli, ['generate', '-t', str(trace)])
+    assert result.exit_code == 0, result.output
+    assert sudoku_trace.sink is sink
+    assert trace.read().startswith('{"event":')